@@ -1,8 +1,13 @@
 __author__ = 'drack3800'
 
+import array
+import collections
 import copy
-import uuid
 import string
+import sys
+
+import parallel
+import stats
 
 # Class that represents automaton state
 
@@ -21,34 +26,6 @@ ALPHABET = set(string.ascii_letters)
 REGEX_SYMBOLS_ALPHABET = ALPHABET.union({CONCAT_SYMBOL, UNION_SYMBOL, KLEENE_SYMBOL})
 
 
-class State():
-    def __init__(self, state_id=None):
-        def generate_id():
-            return int(uuid.uuid4())
-
-        self.id = generate_id() if state_id is None else state_id
-
-    def get_id(self):
-        return int(self.id)
-
-    def __hash__(self):
-        return self.get_id()
-
-    def __eq__(self, other):
-        return self.get_id() == other.get_id()
-
-    def __cmp__(self, other):
-        if self.get_id() < other.get_id():
-            return -1
-        elif self.get_id() > other.get_id():
-            return 1
-        else:
-            return 0
-
-    def __str__(self):
-        return str(self.get_id())[:5]
-
-
 class FiniteAutomaton:
     def __init__(self):
         self.start_state = None
@@ -87,118 +64,489 @@ class NFA(FiniteAutomaton):
 
     NFA has 1 start state and 1 finish state.
     NFA builds with Thompson construction algorithm. (http://en.wikipedia.org/wiki/Thompson's_construction_algorithm)
+    It is built in one pass over regex: states are dense integers, and sub-automata only add states and edges
+    to shared lists, so building takes O(|regex|).
 
+    self.letter_edges[state] is list of (letter, neighbor), self.epsilon_edges[state] is list of neighbors.
     move field is two-dimensional dictionary:  self.move[state][symbol] is set of neighbors
+
+    Sets of states are also integer bitmasks (bit i is state i):
+    self.epsilon_closures[state] is mask of epsilon closure of state,
+    self.class_steps[c][state] is mask of epsilon closure of neighbors of state by letters of alphabet class c
+    (see get_alphabet_classes), so a step of subset construction is a union of masks (see step()).
+    NFA can match words itself by simulation (see accept_word()), it's slower than DFA,
+    but needs no subset construction.
     """
 
     def __init__(self, postfix_regex):
         super().__init__()
         check_regex(postfix_regex)
         self.postfix_regex = postfix_regex
-        if len(postfix_regex) <= 1:
-            # Simple two-states automaton for letter or empty word ("1")
-            self.start_state = State()
-            self.finish_state = State()
-            self.move = {self.start_state: {postfix_regex: {self.finish_state}}}
-        else:
-            # Recursive build according to Thompson algorithm
-            self.start_state = None
-            self.finish_state = None
-            self.move = None
+        self.letter_edges = []
+        self.epsilon_edges = []
+        with stats.timer("nfa.thompson"):
             self.__build_automaton()
+            self.__build_move()
+        with stats.timer("nfa.epsilon_closures"):
+            self.__build_epsilon_closures()
+        with stats.timer("nfa.class_steps"):
+            self.__build_class_steps()
+        if stats.enabled:
+            stats.add("nfa.states", self.get_states_count())
+            stats.add("nfa.transitions", sum(len(edges) for edges in self.letter_edges))
+            stats.add("nfa.epsilon_transitions", sum(len(edges) for edges in self.epsilon_edges))
+
+    def new_state(self):
+        self.letter_edges.append([])
+        self.epsilon_edges.append([])
+        return len(self.letter_edges) - 1
 
     def __build_automaton(self):
+        # Sub-automaton is a pair (start state, finish state)
+        def letters_automaton(letters):
+            # Union of letters is one pair of states with an edge for every letter
+            start_state = self.new_state()
+            finish_state = self.new_state()
+            for letter in sorted(letters):
+                self.letter_edges[start_state].append((letter, finish_state))
+            return start_state, finish_state
+
         def concat(left, right):
-            left.move[left.finish_state] = right.move[right.start_state]
-            left.move = dict(list(left.move.items()) + list(right.move.items()))
-            del left.move[right.start_state]
-            left.finish_state = right.finish_state
-            return left
+            self.epsilon_edges[left[1]].append(right[0])
+            return left[0], right[1]
 
         def union(left, right):
-            left.move = dict(list(left.move.items()) + list(right.move.items()))
-            new_start_state = State()
-            new_finish_state = State()
-            left.move[new_start_state] = {"": {left.start_state, right.start_state}}
-            left.move[left.finish_state] = {"": {new_finish_state}}
-            left.move[right.finish_state] = {"": {new_finish_state}}
-            left.start_state = new_start_state
-            left.finish_state = new_finish_state
-            return left
+            new_start_state = self.new_state()
+            new_finish_state = self.new_state()
+            self.epsilon_edges[new_start_state].extend([left[0], right[0]])
+            self.epsilon_edges[left[1]].append(new_finish_state)
+            self.epsilon_edges[right[1]].append(new_finish_state)
+            return new_start_state, new_finish_state
 
         def kleene(what):
-            new_start_state = State()
-            new_finish_state = State()
-            what.move[new_start_state] = {"": {new_finish_state, what.start_state}}
-            what.move[what.finish_state] = {"": {what.start_state, new_finish_state}}
-            what.start_state = new_start_state
-            what.finish_state = new_finish_state
+            new_start_state = self.new_state()
+            new_finish_state = self.new_state()
+            self.epsilon_edges[new_start_state].extend([new_finish_state, what[0]])
+            self.epsilon_edges[what[1]].extend([what[0], new_finish_state])
+            return new_start_state, new_finish_state
+
+        def pop_automaton():
+            what = stack.pop()
+            if isinstance(what, frozenset):
+                return letters_automaton(what)
             return what
 
-        # Stack keeps automatons for sub-expressions
+        # Stack keeps automatons for sub-expressions, or sets of letters for unions of letters
         stack = []
         for symbol in self.postfix_regex:
             if symbol in ALPHABET:
-                stack.append(NFA(symbol))
+                stack.append(frozenset(symbol))
+            elif symbol == UNION_SYMBOL and isinstance(stack[-1], frozenset) and isinstance(stack[-2], frozenset):
+                right_letters = stack.pop()
+                left_letters = stack.pop()
+                stack.append(left_letters.union(right_letters))
             elif symbol == CONCAT_SYMBOL:
-                right_nfa = stack.pop()
-                left_nfa = stack.pop()
+                right_nfa = pop_automaton()
+                left_nfa = pop_automaton()
                 stack.append(concat(left_nfa, right_nfa))
             elif symbol == UNION_SYMBOL:
-                right_nfa = stack.pop()
-                left_nfa = stack.pop()
+                right_nfa = pop_automaton()
+                left_nfa = pop_automaton()
                 stack.append(union(left_nfa, right_nfa))
             elif symbol == KLEENE_SYMBOL:
-                automaton = stack.pop()
+                automaton = pop_automaton()
                 stack.append(kleene(automaton))
-        # Here there is one NFA in stack - resulting automaton
-        res = stack.pop()
-        self.start_state = res.start_state
-        self.finish_state = res.finish_state
-        self.move = res.move
+        if len(stack) > 0:
+            # Here there is one NFA in stack - resulting automaton
+            self.start_state, self.finish_state = pop_automaton()
+        else:
+            # Empty regex is the empty word
+            self.start_state = self.new_state()
+            self.finish_state = self.new_state()
+            self.epsilon_edges[self.start_state].append(self.finish_state)
+
+    def __build_move(self):
+        self.move = {}
+        for state in range(self.get_states_count()):
+            symbol_neighbors = {}
+            for letter, neighbor in self.letter_edges[state]:
+                symbol_neighbors.setdefault(letter, set()).add(neighbor)
+            if len(self.epsilon_edges[state]) > 0:
+                symbol_neighbors[""] = set(self.epsilon_edges[state])
+            if len(symbol_neighbors) > 0:
+                self.move[state] = symbol_neighbors
+
+    def __build_epsilon_closures(self):
+        """
+        Closure of state is union of closures of its epsilon neighbors, and states of one strongly
+        connected component of epsilon graph have the same closure. Components are found with
+        Tarjan's algorithm, which finds them in reverse topological order, so closures of
+        neighbor components are ready when component is found.
+        """
+        count = self.get_states_count()
+        self.epsilon_closures = [0] * count
+        index = [-1] * count
+        low_link = [0] * count
+        on_stack = [False] * count
+        component_stack = []
+        counter = 0
+        components_count = 0
+        unions_count = 0
+        for root in range(count):
+            if index[root] != -1:
+                continue
+            # Iterative DFS: (state, position of next edge)
+            dfs_stack = [(root, 0)]
+            index[root] = low_link[root] = counter
+            counter += 1
+            component_stack.append(root)
+            on_stack[root] = True
+            while len(dfs_stack) > 0:
+                state, position = dfs_stack[-1]
+                edges = self.epsilon_edges[state]
+                if position < len(edges):
+                    dfs_stack[-1] = (state, position + 1)
+                    neighbor = edges[position]
+                    if index[neighbor] == -1:
+                        index[neighbor] = low_link[neighbor] = counter
+                        counter += 1
+                        component_stack.append(neighbor)
+                        on_stack[neighbor] = True
+                        dfs_stack.append((neighbor, 0))
+                    elif on_stack[neighbor]:
+                        low_link[state] = min(low_link[state], index[neighbor])
+                    continue
+                dfs_stack.pop()
+                if len(dfs_stack) > 0:
+                    parent = dfs_stack[-1][0]
+                    low_link[parent] = min(low_link[parent], low_link[state])
+                if low_link[state] == index[state]:
+                    component = []
+                    while True:
+                        member = component_stack.pop()
+                        on_stack[member] = False
+                        component.append(member)
+                        if member == state:
+                            break
+                    closure = 0
+                    for member in component:
+                        closure |= 1 << member
+                    for member in component:
+                        for neighbor in self.epsilon_edges[member]:
+                            if not on_stack[neighbor]:
+                                closure |= self.epsilon_closures[neighbor]
+                                unions_count += 1
+                    for member in component:
+                        self.epsilon_closures[member] = closure
+                    components_count += 1
+        if stats.enabled:
+            # Closures are computed once per component, NFA.step only reads them
+            stats.add("nfa.epsilon_closure_components", components_count)
+            stats.add("nfa.epsilon_closure_unions", unions_count)
+
+    def __build_class_steps(self):
+        self.alphabet_classes = get_alphabet_classes(self.postfix_regex)
+        classes_count = len(set(self.alphabet_classes.values()))
+        # self.class_sources[c] is mask of states which have edges by letters of class c
+        self.class_sources = [0] * classes_count
+        self.class_steps = [{} for i in range(classes_count)]
+        for state in range(self.get_states_count()):
+            for letter, neighbor in self.letter_edges[state]:
+                symbol_class = self.alphabet_classes[letter]
+                self.class_sources[symbol_class] |= 1 << state
+                class_step = self.class_steps[symbol_class]
+                class_step[state] = class_step.get(state, 0) | self.epsilon_closures[neighbor]
+        self.start_mask = self.epsilon_closures[self.start_state]
+        self.finish_mask = 1 << self.finish_state
+
+    def step(self, mask, symbol_class):
+        """
+        Return mask of states reachable from states of mask by letter of class and epsilon edges
+        """
+        class_step = self.class_steps[symbol_class]
+        sources = mask & self.class_sources[symbol_class]
+        res = 0
+        while sources:
+            low = sources & -sources
+            res |= class_step[low.bit_length() - 1]
+            sources ^= low
+        return res
+
+    def run(self, mask, word):
+        """
+        Return mask of states reached from states of mask by word (Thompson simulation)
+        """
+        for char in word:
+            symbol_class = self.alphabet_classes.get(char)
+            if symbol_class is None:
+                return 0
+            mask = self.step(mask, symbol_class)
+            if mask == 0:
+                return 0
+        return mask
+
+    def accept_word(self, word):
+        # O(|word| * |states|) without building DFA
+        if stats.enabled:
+            stats.add("nfa.simulated_words")
+        return self.run(self.start_mask, word) & self.finish_mask != 0
+
+    def accept_words(self, words, jobs=1):
+        return parallel.accept_words(self, words, jobs)
+
+    def go(self, state, symbol):
+        if symbol == "":
+            return frozenset(self.epsilon_edges[state])
+        return frozenset(neighbor for letter, neighbor in self.letter_edges[state] if letter == symbol)
+
+    def get_states_count(self):
+        return len(self.letter_edges)
 
     def get_postfix_regex(self):
         return self.postfix_regex
 
 
 class DFA(FiniteAutomaton):
-    def __init__(self, build_from):
+    """
+    Initializes an automaton with regular expression in postfix notation or with NFA
+    Example: DFA("ab+abb..*"), DFA("ab+abb..*", minimize=True)
+
+    With construction=THOMPSON (default) DFA builds with subset construction from Thompson NFA,
+    states of DFA are frozensets of NFA states.
+    With construction=POSITIONS DFA builds right from regex with followpos sets (see __build_from_positions),
+    states of DFA are frozensets of regex positions.
+    With minimize=True it is minimized afterwards (see minimize()).
+    """
+
+    THOMPSON = "thompson"
+    POSITIONS = "positions"
+
+    def __init__(self, build_from, minimize=False, construction=THOMPSON):
         super().__init__()
         self.move = {}
         if isinstance(build_from, str):
             check_regex(build_from)
             self.postfix_regex = build_from
-            nfa = NFA(self.postfix_regex)
+            nfa = None
         elif isinstance(build_from, NFA):
             self.postfix_regex = build_from.get_postfix_regex()
             nfa = build_from
         else:
             raise SyntaxError
-        self.__build_from_nfa(nfa)
+        if construction == DFA.THOMPSON:
+            if nfa is None:
+                nfa = NFA(self.postfix_regex)
+            with stats.timer("dfa.subset_construction"):
+                self.__build_from_nfa(nfa)
+        elif construction == DFA.POSITIONS:
+            with stats.timer("dfa.positions_construction"):
+                self.__build_from_positions()
+        else:
+            raise ValueError("Unknown construction {0}".format(construction))
+        if stats.enabled:
+            stats.add("dfa.states", self.get_states_count())
+            stats.add("dfa.transitions", sum(len(symbol_neighbors) for symbol_neighbors in self.move.values()))
+        if minimize:
+            with stats.timer("dfa.minimize"):
+                states_count_before, states_count_after = self.minimize()
+            stats.add("dfa.minimized_states", states_count_before - states_count_after)
 
     def __build_from_nfa(self, nfa):
-        self.start_state = epsilon_closure(nfa, {nfa.get_start_state()})
-        self.move[self.start_state] = {}
-        unmarked_states = [self.start_state]
-        self.finish_state = set()
-        if nfa.get_finish_state() in self.start_state:
-            self.finish_state.add(frozenset(self.start_state))
+        # Sets of NFA states are masks while building, letters of one class have the same transitions
+        self.alphabet_classes = nfa.alphabet_classes
+        classes = get_class_letters(self.alphabet_classes)
+        states_sets = {nfa.start_mask: get_states_set(nfa.start_mask)}
+        unmarked_states = [nfa.start_mask]
+        while len(unmarked_states) > 0:
+            unmarked_state = unmarked_states.pop()
+            states_set = states_sets[unmarked_state]
+            self.move[states_set] = {}
+            for symbol_class, letters in enumerate(classes):
+                neighbor = nfa.step(unmarked_state, symbol_class)
+                if neighbor == 0:
+                    continue
+                if neighbor not in states_sets:
+                    states_sets[neighbor] = get_states_set(neighbor)
+                    unmarked_states.append(neighbor)
+                for char in letters:
+                    self.move[states_set][char] = {states_sets[neighbor]}
+        self.start_state = states_sets[nfa.start_mask]
+        self.finish_state = frozenset(states_sets[mask] for mask in states_sets if mask & nfa.finish_mask)
+        if stats.enabled:
+            # Every DFA state is stepped by every alphabet class once
+            stats.add("dfa.subset_steps", len(states_sets) * len(classes))
+
+    def __build_from_positions(self):
+        """
+        Followpos construction (Aho, Sethi, Ullman "Compilers", 3.9), no NFA and no epsilon transitions.
+        Positions are atoms of regex: letters and unions of letters (see get_alphabet_classes).
+        DFA state is a set of positions which can be read next, end position means the word is accepted.
+        Sets of positions are integer bitmasks while building.
+        """
+        self.alphabet_classes = get_alphabet_classes(self.postfix_regex)
+        classes = get_class_letters(self.alphabet_classes)
+        # class_positions[c] is mask of positions which can read letters of class c
+        class_positions = [0] * len(classes)
+        follow = []
+
+        def add_position(letters):
+            position = len(follow)
+            follow.append(0)
+            for c in {self.alphabet_classes[letter] for letter in letters}:
+                class_positions[c] |= 1 << position
+            # nullable, firstpos, lastpos
+            return False, 1 << position, 1 << position
+
+        def add_follow(positions, mask):
+            while positions:
+                low = positions & -positions
+                follow[low.bit_length() - 1] |= mask
+                positions ^= low
+
+        def pop_node():
+            node = stack.pop()
+            if isinstance(node, frozenset):
+                return add_position(node)
+            return node
+
+        # Stack keeps (nullable, firstpos, lastpos) of sub-expressions, or sets of letters for unions of letters
+        stack = []
+        for symbol in self.postfix_regex:
+            if symbol in ALPHABET:
+                stack.append(frozenset(symbol))
+            elif symbol == UNION_SYMBOL and isinstance(stack[-1], frozenset) and isinstance(stack[-2], frozenset):
+                right_letters = stack.pop()
+                left_letters = stack.pop()
+                stack.append(left_letters.union(right_letters))
+            elif symbol == CONCAT_SYMBOL:
+                right_nullable, right_first, right_last = pop_node()
+                left_nullable, left_first, left_last = pop_node()
+                add_follow(left_last, right_first)
+                stack.append((left_nullable and right_nullable,
+                              left_first | right_first if left_nullable else left_first,
+                              left_last | right_last if right_nullable else right_last))
+            elif symbol == UNION_SYMBOL:
+                right_nullable, right_first, right_last = pop_node()
+                left_nullable, left_first, left_last = pop_node()
+                stack.append((left_nullable or right_nullable, left_first | right_first, left_last | right_last))
+            elif symbol == KLEENE_SYMBOL:
+                nullable, first, last = pop_node()
+                add_follow(last, first)
+                stack.append((True, first, last))
+        if len(stack) > 0:
+            nullable, first, last = pop_node()
+        else:
+            # Empty regex is the empty word
+            nullable, first, last = True, 0, 0
+
+        end = 1 << len(follow)
+        add_follow(last, end)
+        start = first | end if nullable else first
+
+        states_sets = {start: get_states_set(start)}
+        unmarked_states = [start]
         while len(unmarked_states) > 0:
-            unmarked_state = unmarked_states.pop(0)
-            for char in ALPHABET:
-                adj_neighbors = set()
-                for state in unmarked_state:
-                    adj_neighbors = adj_neighbors.union(nfa.go(state, char))
-                if len(adj_neighbors) > 0:
-                    neighbors_set = epsilon_closure(nfa, adj_neighbors)
-                    if len(neighbors_set) > 0:
-                        if neighbors_set not in self.move.keys():
-                            unmarked_states.append(neighbors_set)
-                            self.move[neighbors_set] = {}
-                        self.move[unmarked_state][char] = {neighbors_set}
-                        if nfa.get_finish_state() in neighbors_set:
-                            self.finish_state.add(frozenset(neighbors_set))
-        self.finish_state = frozenset(self.finish_state)
+            unmarked_state = unmarked_states.pop()
+            states_set = states_sets[unmarked_state]
+            self.move[states_set] = {}
+            for c, letters in enumerate(classes):
+                positions = unmarked_state & class_positions[c]
+                neighbor = 0
+                while positions:
+                    low = positions & -positions
+                    neighbor |= follow[low.bit_length() - 1]
+                    positions ^= low
+                if neighbor == 0:
+                    continue
+                if neighbor not in states_sets:
+                    states_sets[neighbor] = get_states_set(neighbor)
+                    unmarked_states.append(neighbor)
+                for char in letters:
+                    self.move[states_set][char] = {states_sets[neighbor]}
+        self.start_state = states_sets[start]
+        self.finish_state = frozenset(states_sets[positions] for positions in states_sets if positions & end)
+
+    def minimize(self):
+        """
+        Minimizes automaton in place with Hopcroft's algorithm, O(n * k * log n)
+        (http://en.wikipedia.org/wiki/DFA_minimization#Hopcroft.27s_algorithm)
+        Returns pair (states count before, states count after)
+        """
+        states_count_before = self.get_states_count()
+        states = list(self.move.keys())
+        number = {state: i for i, state in enumerate(states)}
+        # Missing transitions lead to extra dead state
+        dead = len(states)
+        # One letter of each class is enough, letters of class have the same transitions
+        symbols = [letters[0] for letters in get_class_letters(self.alphabet_classes)]
+
+        # inverse[char][state] is list of states which go to state by char
+        inverse = {char: [[] for i in range(dead + 1)] for char in symbols}
+        for state in states:
+            for char in symbols:
+                neighbors_set = self.go(state, char)
+                target = number[set(neighbors_set).pop()] if neighbors_set else dead
+                inverse[char][target].append(number[state])
+        for char in symbols:
+            inverse[char][dead].append(dead)
+
+        finish = {number[state] for state in self.finish_state}
+        blocks = [finish, set(range(dead + 1)) - finish]
+        blocks = [block for block in blocks if block]
+        block_of = [0] * (dead + 1)
+        for i, block in enumerate(blocks):
+            for state in block:
+                block_of[state] = i
+
+        smallest = min(range(len(blocks)), key=lambda i: len(blocks[i]))
+        waiting = {(smallest, char) for char in symbols}
+        while waiting:
+            splitter, char = waiting.pop()
+            # States which go into splitter block by char, grouped by their blocks
+            touched = {}
+            for target in blocks[splitter]:
+                for state in inverse[char][target]:
+                    touched.setdefault(block_of[state], set()).add(state)
+            for i, intersection in touched.items():
+                if len(intersection) == len(blocks[i]):
+                    continue
+                # Split block i into intersection and the rest
+                blocks[i] -= intersection
+                j = len(blocks)
+                blocks.append(intersection)
+                for state in intersection:
+                    block_of[state] = j
+                for other_char in symbols:
+                    if (i, other_char) in waiting:
+                        waiting.add((j, other_char))
+                    elif len(blocks[i]) <= len(blocks[j]):
+                        waiting.add((i, other_char))
+                    else:
+                        waiting.add((j, other_char))
+
+        # Build new automaton from block representatives, dead block is dropped
+        dead_block = block_of[dead]
+        representative = {}
+        for i, state in enumerate(states):
+            representative.setdefault(block_of[i], state)
+        representative[block_of[number[self.start_state]]] = self.start_state
+        move = {}
+        for i, state in representative.items():
+            if i == dead_block:
+                continue
+            move[state] = {}
+            for char, neighbors_set in self.move[state].items():
+                target_block = block_of[number[set(neighbors_set).pop()]]
+                if target_block != dead_block:
+                    move[state][char] = {representative[target_block]}
+        if self.start_state not in move:
+            move[self.start_state] = {}
+        self.move = move
+        self.finish_state = frozenset(representative[block_of[number[state]]] for state in self.finish_state)
+        return states_count_before, self.get_states_count()
+
+    def get_states_count(self):
+        return len(self.move)
 
     def accept_word(self, word):
         state = self.start_state
@@ -234,6 +582,272 @@ class DFA(FiniteAutomaton):
                     res += "({0}, {1}, {2})\n".format(get_set_name(states_set), symbol, get_set_name(neighbor))
         return res
 
+    def accept_words(self, words, jobs=1):
+        # Automaton is compiled once and shared by all jobs
+        return self.compile().accept_words(words, jobs)
+
+    def compile(self):
+        return CompiledDFA(self)
+
+
+"""
+CompiledDFA is a table-driven form of DFA for fast word matching
+"""
+
+
+class CompiledDFA():
+    """
+    Initializes with DFA, NFA or regular expression in postfix notation
+    Example: CompiledDFA("ab+abb..*") or CompiledDFA(DFA("ab+abb..*"))
+
+    States are dense integers, 0 is the start state.
+    self.symbol_codes[char] is the column of char in the transition table, letters of one alphabet class
+    (see get_alphabet_classes) share the column.
+    self.table[state * self.alphabet_size + symbol_code] is the next state or DEAD_STATE
+    self.accepting[state] is 1 if state is a finish state, else 0
+    """
+
+    DEAD_STATE = -1
+
+    def __init__(self, build_from):
+        if not isinstance(build_from, DFA):
+            build_from = DFA(build_from, minimize=True)
+        self.postfix_regex = build_from.postfix_regex
+        self.__build_from_dfa(build_from)
+
+    @staticmethod
+    def from_tables(postfix_regex, symbol_codes, alphabet_size, table, accepting):
+        """
+        Return compiled automaton with given tables (see fields description above)
+        """
+        res = CompiledDFA.__new__(CompiledDFA)
+        res.postfix_regex = postfix_regex
+        res.symbol_codes = symbol_codes
+        res.alphabet_size = alphabet_size
+        res.states_count = len(accepting)
+        res.table = table
+        res.accepting = accepting
+        return res
+
+    def __build_from_dfa(self, dfa):
+        # Columns of table are alphabet classes, letters which are not in regex have no column
+        self.symbol_codes = dict(dfa.alphabet_classes)
+        classes = get_class_letters(self.symbol_codes)
+        self.alphabet_size = len(classes)
+
+        # Number states in BFS order, so start state gets 0
+        numbers = {dfa.start_state: 0}
+        order = [dfa.start_state]
+        for states_set in order:
+            for letters in classes:
+                for neighbor in dfa.go(states_set, letters[0]):
+                    if neighbor not in numbers:
+                        numbers[neighbor] = len(order)
+                        order.append(neighbor)
+
+        self.states_count = len(order)
+        self.table = array.array('i', [CompiledDFA.DEAD_STATE]) * (self.states_count * self.alphabet_size)
+        self.accepting = bytearray(self.states_count)
+        for states_set, number in numbers.items():
+            for char, neighbors_set in dfa.move.get(states_set, {}).items():
+                for neighbor in neighbors_set:
+                    self.table[number * self.alphabet_size + self.symbol_codes[char]] = numbers[neighbor]
+            if states_set in dfa.finish_state:
+                self.accepting[number] = 1
+
+    def accept_word(self, word):
+        if stats.enabled:
+            stats.add("dfa.words")
+        table = self.table
+        codes = self.symbol_codes
+        size = self.alphabet_size
+        state = 0
+        for char in word:
+            code = codes.get(char)
+            if code is None:
+                return False
+            state = table[state * size + code]
+            if state < 0:
+                return False
+        return self.accepting[state] == 1
+
+    def accept_words(self, words, jobs=1):
+        return parallel.accept_words(self, words, jobs)
+
+    def get_states_count(self):
+        return self.states_count
+
+
+"""
+LazyDFA is a DFA which builds its states on the fly, as words reach them
+"""
+
+
+class LazyDFA():
+    """
+    Initializes with NFA or regular expression in postfix notation
+    Example: LazyDFA("ab+*a.ab+.ab+.", cache_size=1024)
+
+    States are sets of NFA states (as masks, see NFA), like in DFA, but only those reached by words are built.
+    Transitions are kept in LRU cache of cache_size entries.
+    Hit rate of the cache is measured over windows of THRASH_STEPS steps, which go across words.
+    When cache is full and less than THRASH_HIT_RATE of steps of a window were hits (cache thrashes),
+    the rest of the word and next words are matched by NFA simulation without touching the cache.
+    While cache thrashes, one word of PROBE_WORDS goes through the cache to measure hit rate again.
+    """
+
+    DEFAULT_CACHE_SIZE = 4096
+    THRASH_STEPS = 32
+    THRASH_HIT_RATE = 0.5
+    PROBE_WORDS = 16
+
+    def __init__(self, build_from, cache_size=DEFAULT_CACHE_SIZE):
+        if isinstance(build_from, str):
+            build_from = NFA(build_from)
+        elif not isinstance(build_from, NFA):
+            raise SyntaxError
+        self.postfix_regex = build_from.get_postfix_regex()
+        self.nfa = build_from
+        self.start_state = self.nfa.start_mask
+        self.alphabet_classes = self.nfa.alphabet_classes
+        self.cache_size = cache_size
+        # (states mask, alphabet class) -> states mask, the most recently used at the end
+        self.transitions = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.simulated_words = 0
+        # Window of hit rate: steps done in it and hits before it; words simulated since the last probe
+        self.thrashing = False
+        self.window_steps = 0
+        self.window_hits = 0
+        self.skipped_words = 0
+
+    def go(self, states_mask, symbol):
+        symbol_class = self.alphabet_classes.get(symbol)
+        if symbol_class is None:
+            return 0
+        key = (states_mask, symbol_class)
+        neighbors_mask = self.transitions.get(key)
+        if neighbors_mask is not None:
+            self.transitions.move_to_end(key)
+            self.hits += 1
+            return neighbors_mask
+        self.misses += 1
+        neighbors_mask = self.nfa.step(states_mask, symbol_class)
+        self.transitions[key] = neighbors_mask
+        if len(self.transitions) > self.cache_size:
+            self.transitions.popitem(last=False)
+        return neighbors_mask
+
+    def accept_word(self, word):
+        if not stats.enabled:
+            return self.__match(word)
+        # Counters are added once per word
+        misses_before = self.misses
+        simulated_before = self.simulated_words
+        res = self.__match(word)
+        stats.add("lazy.misses", self.misses - misses_before)
+        stats.add("lazy.simulated_words", self.simulated_words - simulated_before)
+        return res
+
+    def __match(self, word):
+        if self.thrashing and self.skipped_words < LazyDFA.PROBE_WORDS - 1:
+            self.skipped_words += 1
+            return self.__simulate(self.start_state, word)
+        self.skipped_words = 0
+        states_mask = self.start_state
+        for i, char in enumerate(word):
+            states_mask = self.go(states_mask, char)
+            if states_mask == 0:
+                return False
+            self.window_steps += 1
+            if self.window_steps == LazyDFA.THRASH_STEPS:
+                self.thrashing = len(self.transitions) >= self.cache_size and \
+                    self.hits - self.window_hits < LazyDFA.THRASH_HIT_RATE * LazyDFA.THRASH_STEPS
+                self.window_steps = 0
+                self.window_hits = self.hits
+                if self.thrashing:
+                    return self.__simulate(states_mask, word[i + 1:])
+        return states_mask & self.nfa.finish_mask != 0
+
+    def __simulate(self, states_mask, word):
+        self.simulated_words += 1
+        return self.nfa.run(states_mask, word) & self.nfa.finish_mask != 0
+
+    def accept_words(self, words, jobs=1):
+        return parallel.accept_words(self, words, jobs)
+
+    def get_states_count(self):
+        # Number of states which are kept in cache now
+        states = {self.start_state}
+        for (states_mask, symbol_class), neighbors_mask in self.transitions.items():
+            states.add(states_mask)
+            states.add(neighbors_mask)
+        return len(states)
+
+
+def get_states_set(mask):
+    """
+    Return frozenset of numbers of bits of mask
+    """
+    res = []
+    while mask:
+        low = mask & -mask
+        res.append(low.bit_length() - 1)
+        mask ^= low
+    return frozenset(res)
+
+
+def get_alphabet_classes(postfix_regex):
+    """
+    Return dict: letter -> number of its alphabet class, for letters of regex
+    Letters of one class can't be distinguished by automaton: they appear in regex only together,
+    in the same unions of letters. For example, classes of "ab+*c." are {a, b} and {c}.
+    Letters which are not in regex have no class.
+    """
+    # Sets of letters which are atoms of regex: single letters and unions of letters
+    atoms = []
+    stack = []
+    for symbol in postfix_regex:
+        if symbol in ALPHABET:
+            stack.append(frozenset(symbol))
+        elif symbol == UNION_SYMBOL and stack[-1] is not None and stack[-2] is not None:
+            right_letters = stack.pop()
+            left_letters = stack.pop()
+            stack.append(left_letters.union(right_letters))
+        else:
+            operands = 1 if symbol == KLEENE_SYMBOL else 2
+            for i in range(operands):
+                letters = stack.pop()
+                if letters is not None:
+                    atoms.append(letters)
+            stack.append(None)
+    atoms.extend(letters for letters in stack if letters is not None)
+
+    # Letters are in one class iff they are in the same atoms
+    signatures = {}
+    for i, letters in enumerate(atoms):
+        for letter in letters:
+            signatures.setdefault(letter, []).append(i)
+    class_numbers = {}
+    classes = {}
+    for letter in sorted(signatures.keys()):
+        signature = tuple(signatures[letter])
+        if signature not in class_numbers:
+            class_numbers[signature] = len(class_numbers)
+        classes[letter] = class_numbers[signature]
+    return classes
+
+
+def get_class_letters(alphabet_classes):
+    """
+    Return list: number of alphabet class -> sorted list of its letters
+    """
+    res = [[] for i in range(len(set(alphabet_classes.values())))]
+    for letter in sorted(alphabet_classes.keys()):
+        res[alphabet_classes[letter]].append(letter)
+    return res
+
 
 def check_regex(postfix_regex):
     counter = 0
@@ -271,6 +885,12 @@ def test_word(dfa, word):
     print("Accepts " + word + ": " + str(dfa.accept_word(word)))
 
 if __name__ == "__main__":
+    # Report DFA sizes before and after minimization: python automata.py REGEX [REGEX ...]
+    if len(sys.argv) > 1:
+        for regex in sys.argv[1:]:
+            before, after = DFA(regex).minimize()
+            print("{0}: {1} -> {2} states".format(regex, before, after))
+        sys.exit()
     # a = NFA('ab+*')
     # print(a)
     a = DFA('aa.*b*.cc.*.')  # (aa)*b*(aa)*
@@ -0,0 +1,358 @@
+from automata import NFA, DFA
+from grammar import CFG
+
+__author__ = 'drack3800'
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+"""
+Benchmarks for automata and grammar classes
+Usage: python benchmark.py construction|cnf|parsers|prefixes|regex
+       python benchmark.py suite [--seed SEED] [--words COUNT] [--output FILE]
+
+suite runs all measurements on generated workloads and writes JSON results (see run_suite),
+so results of different versions can be compared.
+"""
+
+
+def measure(function, repeat=5):
+    # Best of repeat runs, in seconds
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def measure_latencies(function, items):
+    # Seconds of function(item) for every item
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        function(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def measure_memory(function):
+    # Peak memory in bytes allocated by function, it is measured apart from time as tracing is slow
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def get_percentile(sorted_values, percent):
+    # Nearest-rank percentile
+    index = max(0, min(len(sorted_values) - 1, int(round(percent / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def get_latency_metrics(latencies):
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {
+        "count": len(latencies),
+        "seconds": total,
+        "throughput": len(latencies) / total if total > 0 else None,
+        "p50": get_percentile(latencies, 50),
+        "p90": get_percentile(latencies, 90),
+        "p99": get_percentile(latencies, 99),
+        "max": latencies[-1],
+    }
+
+
+def generate_regex(length, rng, letters="ab"):
+    """
+    Random regex in postfix notation with length letters
+    """
+    if length == 1:
+        regex = rng.choice(letters)
+    else:
+        left = rng.randint(1, length - 1)
+        regex = generate_regex(left, rng, letters) + generate_regex(length - left, rng, letters)
+        regex += rng.choice([".", ".", "+"])
+    if rng.random() < 0.1:
+        regex += "*"
+    return regex
+
+
+def generate_long_regex(length, rng, letters="abc"):
+    """
+    Regex in postfix notation which is concatenation of length small pieces: a, a*, (a+b), (a+b)*
+    DFA of such regex is small, so construction time shows the cost of regex processing itself
+    """
+    pieces = []
+    for i in range(length):
+        piece = rng.choice(letters)
+        if rng.random() < 0.3:
+            piece += rng.choice(letters) + "+"
+        if rng.random() < 0.3:
+            piece += "*"
+        pieces.append(piece)
+    return pieces[0] + "".join(piece + "." for piece in pieces[1:])
+
+
+def generate_nested_regex(depth, rng, letters="ab"):
+    """
+    Random regex in postfix notation with nesting depth of operations
+    """
+    if depth == 0:
+        return rng.choice(letters)
+    regex = generate_nested_regex(depth - 1, rng, letters) + generate_nested_regex(rng.randint(0, depth - 1), rng,
+                                                                                   letters)
+    regex += rng.choice([".", "+"])
+    if rng.random() < 0.3:
+        regex += "*"
+    return regex
+
+
+def generate_grammar(rules_count, rng, non_terminals_count=10, min_length=1, max_length=4, letters="ab",
+                     terminal_rules_count=0):
+    """
+    Random grammar with rules_count rules and terminal_rules_count more rules A -> a for random A
+    """
+    non_terminals = ["S"] + ["A" + str(i) for i in range(1, non_terminals_count)]
+    production_rules = [(rng.choice(non_terminals), rng.choice(letters)) for i in range(terminal_rules_count)]
+    for i in range(rules_count):
+        left = non_terminals[i % non_terminals_count]
+        right = [rng.choice(non_terminals + list(letters)) for j in range(rng.randint(min_length, max_length))]
+        production_rules.append((left, ' '.join(right)))
+    return CFG("S", production_rules)
+
+
+def generate_dyck_word(length, rng):
+    # Random balanced word of a (open) and b (close) of even length
+    word = []
+    depth = 0
+    for i in range(length - length % 2):
+        left = length - length % 2 - i
+        if depth > 0 and (depth == left or rng.random() < 0.5):
+            word.append("b")
+            depth -= 1
+        else:
+            word.append("a")
+            depth += 1
+    return "".join(word)
+
+
+def generate_arithmetic_word(length, rng):
+    # Random expression of x with p (plus), m (multiply) and brackets l, r, about length letters
+    if length <= 2:
+        return "x"
+    if rng.random() < 0.2:
+        return "l" + generate_arithmetic_word(length - 2, rng) + "r"
+    left = rng.randint(1, length - 2)
+    return generate_arithmetic_word(left, rng) + rng.choice("pm") + generate_arithmetic_word(length - left - 1, rng)
+
+
+def generate_palindrome(length, rng):
+    half = "".join(rng.choice("ab") for i in range(length // 2))
+    return half + ("a" if length % 2 else "") + half[::-1]
+
+
+# Production rules of grammars of benchmarks, start symbol is the left part of the first rule
+GRAMMARS = {
+    "dyck": [("S", "a S b S"), ("S", "")],
+    "arithmetic": [("E", "E p T"), ("E", "T"), ("T", "T m F"), ("T", "F"), ("F", "l E r"), ("F", "x")],
+    "palindromes": [("S", "a S a"), ("S", "b S b"), ("S", "a"), ("S", "b"), ("S", "")],
+    "ambiguous": [("S", "S S"), ("S", "a")],
+    "right recursive": [("S", "a S"), ("S", "b")],
+    "left recursive": [("S", "S a"), ("S", "b")],
+}
+
+# Grammar families of different ambiguity: name, production rules, generator of random word of given length
+GRAMMAR_FAMILIES = [
+    ("dyck", GRAMMARS["dyck"], generate_dyck_word),
+    ("arithmetic", GRAMMARS["arithmetic"], generate_arithmetic_word),
+    ("palindromes", GRAMMARS["palindromes"], generate_palindrome),
+    ("ambiguous", GRAMMARS["ambiguous"], lambda length, rng: "a" * length),
+]
+
+
+def generate_words(generate_word, count, length, rng, letters):
+    # Half of words are generated by generate_word, the other half are random and mostly rejected
+    words = []
+    for i in range(count):
+        if i % 2 == 0:
+            words.append(generate_word(length, rng))
+        else:
+            words.append("".join(rng.choice(letters) for j in range(length)))
+    return words
+
+
+def benchmark_construction(seed=0):
+    rng = random.Random(seed)
+    print("{0:>30} {1:>10}".format("case", "seconds"))
+    for length in [10, 30, 60]:
+        regex = generate_regex(length, rng)
+        print("{0:>30} {1:>10.5f}".format("NFA, regex length " + str(length), measure(lambda: NFA(regex))))
+        print("{0:>30} {1:>10.5f}".format("DFA, regex length " + str(length), measure(lambda: DFA(regex))))
+    for rules_count in [10, 30, 100]:
+        grammar = generate_grammar(rules_count, rng)
+        print("{0:>30} {1:>10.5f}".format("CNF, rules " + str(rules_count), measure(grammar.get_in_cnf)))
+
+
+def benchmark_cnf(seed=0):
+    rng = random.Random(seed)
+    print("{0:>30} {1:>10} {2:>10} {3:>10}".format("case", "seconds", "rules", "cnf rules"))
+    for rules_count in [100, 1000, 5000]:
+        grammar = generate_grammar(rules_count, rng, non_terminals_count=rules_count // 10, min_length=2,
+                                   terminal_rules_count=rules_count // 20)
+        print("{0:>30} {1:>10.5f} {2:>10} {3:>10}".format("CNF, rules " + str(rules_count),
+                                                          measure(grammar.get_in_cnf, repeat=3),
+                                                          grammar.get_size()[1], grammar.get_in_cnf().get_size()[1]))
+
+
+def benchmark_regex(seed=0):
+    rng = random.Random(seed)
+    print("{0:>30} {1:>10} {2:>10}".format("case", "thompson", "positions"))
+    for length in [100, 1000, 3000]:
+        regex = generate_long_regex(length, rng)
+        thompson = measure(lambda: DFA(regex, construction=DFA.THOMPSON), repeat=3)
+        positions = measure(lambda: DFA(regex, construction=DFA.POSITIONS), repeat=3)
+        print("{0:>30} {1:>10.5f} {2:>10.5f}".format("DFA, regex length " + str(len(regex)), thompson, positions))
+
+
+# Grammar classes for parsers benchmark: name (see GRAMMARS), generator of word of length about n
+PARSER_GRAMMARS = [
+    ("right recursive", lambda n: "a" * (n - 1) + "b"),
+    ("left recursive", lambda n: "b" + "a" * (n - 1)),
+    ("dyck", lambda n: "ab" * (n // 4) + "a" * (n // 4) + "b" * (n // 4)),
+    ("arithmetic", lambda n: "xpxmlxpxrp" * (n // 10) + "x"),
+    ("ambiguous", lambda n: "a" * n),
+]
+
+
+def benchmark_parsers(seed=0):
+    print("{0:>30} {1:>10} {2:>10}".format("case", "cyk", "earley"))
+    for name, generate_word in PARSER_GRAMMARS:
+        production_rules = GRAMMARS[name]
+        start = production_rules[0][0]
+        for length in [50, 200]:
+            word = generate_word(length)
+            cyk = CFG(start, production_rules, engine=CFG.CYK).get_recognizer()
+            earley = CFG(start, production_rules, engine=CFG.EARLEY).get_recognizer()
+            assert cyk.accept_word(word) == earley.accept_word(word) == True
+            print("{0:>30} {1:>10.5f} {2:>10.5f}".format(
+                name + ", length " + str(len(word)),
+                measure(lambda: cyk.accept_word(word), repeat=3),
+                measure(lambda: earley.accept_word(word), repeat=3)))
+
+
+def benchmark_prefixes(seed=0):
+    rng = random.Random(seed)
+    grammar = GRAMMARS["dyck"]
+    print("{0:>30} {1:>10} {2:>10}".format("case", "cyk", "incremental"))
+    for prefix_length in [20, 100]:
+        # Words are a long common prefix with short random tails, like lines of a log
+        prefix = "ab" * (prefix_length // 2)
+        words = [prefix + "".join(rng.choice("ab") for j in range(rng.randint(0, 8))) for i in range(1000)]
+        cyk = CFG("S", grammar, engine=CFG.CYK)
+        incremental = CFG("S", grammar, engine=CFG.INCREMENTAL)
+        assert list(cyk.accept_words(words)) == list(incremental.accept_words(words))
+        print("{0:>30} {1:>10.5f} {2:>10.5f}".format(
+            "1000 words, prefix " + str(prefix_length),
+            measure(lambda: list(cyk.accept_words(words)), repeat=3),
+            measure(lambda: list(incremental.accept_words(words)), repeat=3)))
+
+
+def run_suite(seed=0, words_count=200):
+    """
+    Return dict with measurements on generated workloads, every result is
+    {"case": name of measured operation, "params": workload parameters, "metrics": measured values}
+    Times are in seconds, memory is peak traced memory in bytes.
+    """
+    rng = random.Random(seed)
+    results = []
+
+    def add_result(case, params, **metrics):
+        results.append({"case": case, "params": params, "metrics": metrics})
+
+    for length, depth in [(10, 3), (30, 5), (60, 7)]:
+        regexes = [("length", length, generate_regex(length, rng)), ("depth", depth, generate_nested_regex(depth, rng))]
+        for kind, size, regex in regexes:
+            params = {kind: size, "regex_length": len(regex)}
+            nfa = NFA(regex)
+            add_result("nfa_build", params, seconds=measure(lambda: NFA(regex), repeat=3),
+                       memory=measure_memory(lambda: NFA(regex)), states=nfa.get_states_count())
+            dfa = DFA(regex, minimize=True)
+            add_result("dfa_build", params, seconds=measure(lambda: DFA(regex, minimize=True), repeat=3),
+                       memory=measure_memory(lambda: DFA(regex, minimize=True)), states=dfa.get_states_count())
+            for word_length in [10, 100]:
+                word_params = dict(params, words=words_count, word_length=word_length)
+                words = ["".join(rng.choice("ab") for j in range(word_length)) for i in range(words_count)]
+                add_result("dfa_accept_word", word_params, **get_latency_metrics(
+                    measure_latencies(dfa.accept_word, words)))
+                compiled = dfa.compile()
+                add_result("compiled_dfa_accept_word", word_params, **get_latency_metrics(
+                    measure_latencies(compiled.accept_word, words)))
+
+    for rules_count in [10, 100, 1000]:
+        grammar = generate_grammar(rules_count, rng, non_terminals_count=max(2, rules_count // 10), min_length=2,
+                                   terminal_rules_count=max(1, rules_count // 20))
+        params = {"grammar": "random", "rules": grammar.get_size()[1]}
+        add_result("get_in_cnf", params, seconds=measure(grammar.get_in_cnf, repeat=3),
+                   memory=measure_memory(grammar.get_in_cnf), cnf_rules=grammar.get_in_cnf().get_size()[1])
+
+    for name, production_rules, generate_word in GRAMMAR_FAMILIES:
+        start = production_rules[0][0]
+        grammar = CFG(start, production_rules)
+        params = {"grammar": name, "rules": grammar.get_size()[1]}
+        add_result("get_in_cnf", params, seconds=measure(grammar.get_in_cnf, repeat=3),
+                   memory=measure_memory(grammar.get_in_cnf), cnf_rules=grammar.get_in_cnf().get_size()[1])
+        letters = "".join(sorted(grammar.get_terminals()))
+        for engine in CFG.ENGINES:
+            for word_length in [10, 50]:
+                words = generate_words(generate_word, words_count, word_length, rng, letters)
+                recognizer = CFG(start, production_rules, engine=engine).get_recognizer()
+                word_params = dict(params, engine=engine, words=words_count, word_length=word_length)
+                metrics = get_latency_metrics(measure_latencies(recognizer.accept_word, words))
+                metrics["memory"] = measure_memory(lambda: [recognizer.accept_word(word) for word in words[:10]])
+                add_result("cfg_accept_word", word_params, **metrics)
+
+    return {
+        "seed": seed,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "results": results,
+    }
+
+
+BENCHMARKS = {
+    "construction": benchmark_construction,
+    "cnf": benchmark_cnf,
+    "parsers": benchmark_parsers,
+    "prefixes": benchmark_prefixes,
+    "regex": benchmark_regex,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS.keys()) + ["suite"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--words", type=int, default=200, help="number of words per case of suite")
+    parser.add_argument("--output", default=None, help="file for JSON results of suite, stdout by default")
+    args = parser.parse_args()
+    if args.benchmark == "suite":
+        suite = run_suite(args.seed, args.words)
+        if args.output is None:
+            json.dump(suite, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.output, "w") as output_file:
+                json.dump(suite, output_file, indent=2)
+    else:
+        BENCHMARKS[args.benchmark](args.seed)
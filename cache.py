@@ -0,0 +1,209 @@
+from automata import DFA, CompiledDFA
+from grammar import CompactGrammar
+
+__author__ = 'drack3800'
+
+import array
+import hashlib
+import os
+import struct
+import tempfile
+
+"""
+Persistent cache of compiled automata and grammars in Chomsky Normal Form.
+
+Files are content-addressed: name is a hash of postfix regex or of the sorted production rules,
+so the same regex or grammar is never built twice. Files have compact binary format:
+
+automaton: magic, header (regex length, symbols count, alphabet size, states count),
+           regex, symbols, symbol codes (int32), transition table (int32), accepting bitmap
+grammar:   magic, header (symbols count, start symbol, rules data length),
+           symbol names (each is length + name), rules data (uint32: left, length, right symbols...)
+
+Cache directory is bounded by size, least recently used files are deleted first.
+"""
+
+AUTOMATON_MAGIC = b"FLDFA\x00\x00\x01"
+GRAMMAR_MAGIC = b"FLCFG\x00\x00\x01"
+AUTOMATON_HEADER = struct.Struct("<IIII")
+GRAMMAR_HEADER = struct.Struct("<III")
+NAME_LENGTH = struct.Struct("<H")
+
+DEFAULT_MAX_SIZE = 256 << 20
+
+
+class CompiledCache():
+    """
+    Initializes with cache directory, which is created if needed
+    Example: CompiledCache("/tmp/cache").get_automaton("ab+*")
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def get_automaton(self, postfix_regex):
+        """
+        Return minimized CompiledDFA for regex, from cache if possible
+        """
+        path = self.__get_path("dfa", postfix_regex)
+        automaton = self.__load(path, load_automaton)
+        if automaton is None:
+            automaton = DFA(postfix_regex, minimize=True).compile()
+            self.__store(path, dump_automaton(automaton))
+        return automaton
+
+    def get_grammar(self, grammar):
+        """
+        Return grammar in Chomsky Normal Form for grammar, from cache if possible
+        """
+        rules = sorted((left, right) for left, right_set in grammar.productions.items() for right in right_set)
+        key = grammar.start + "\n" + "\n".join(left + " -> " + right for left, right in rules)
+        path = self.__get_path("cfg", key)
+        cnf = self.__load(path, load_grammar)
+        if cnf is None:
+            cnf = grammar.get_in_cnf()
+            self.__store(path, dump_grammar(cnf))
+        grammar.chomsky_form = cnf
+        return cnf
+
+    def __get_path(self, kind, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + "." + kind)
+
+    def __load(self, path, loader):
+        try:
+            # One read of the whole file, arrays are copied out of it once
+            with open(path, "rb") as cache_file:
+                res = loader(memoryview(cache_file.read()))
+        except (OSError, ValueError, struct.error, UnicodeDecodeError):
+            # Missing or broken file is built again
+            return None
+        # Modification time is the last use time for eviction
+        os.utime(path)
+        return res
+
+    def __store(self, path, data):
+        descriptor, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+        self.__evict(keep=path)
+
+    def __evict(self, keep):
+        files = []
+        total_size = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith((".dfa", ".cfg")):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+                total_size += stat.st_size
+        for mtime, path, size in sorted(files):
+            if total_size <= self.max_size:
+                break
+            if path != keep:
+                os.remove(path)
+                total_size -= size
+
+
+def dump_automaton(automaton):
+    regex = automaton.postfix_regex.encode()
+    symbols = sorted(automaton.symbol_codes.keys())
+    codes = array.array("i", [automaton.symbol_codes[symbol] for symbol in symbols])
+    table = array.array("i", automaton.table)
+    return b"".join([
+        AUTOMATON_MAGIC,
+        AUTOMATON_HEADER.pack(len(regex), len(symbols), automaton.alphabet_size, automaton.states_count),
+        regex,
+        "".join(symbols).encode(),
+        codes.tobytes(),
+        table.tobytes(),
+        bytes(automaton.accepting),
+    ])
+
+
+def load_automaton(data):
+    offset = _check_magic(data, AUTOMATON_MAGIC)
+    regex_length, symbols_count, alphabet_size, states_count = AUTOMATON_HEADER.unpack_from(data, offset)
+    offset += AUTOMATON_HEADER.size
+    regex = bytes(data[offset:offset + regex_length]).decode()
+    offset += regex_length
+    symbols = bytes(data[offset:offset + symbols_count]).decode()
+    offset += symbols_count
+    codes, offset = _read_array(data, offset, "i", symbols_count)
+    table, offset = _read_array(data, offset, "i", states_count * alphabet_size)
+    accepting = bytearray(data[offset:offset + states_count])
+    if len(accepting) != states_count or states_count == 0:
+        raise ValueError("Truncated automaton")
+    # Well-formed file may still be corrupt, bad entry would fail in accept_word later
+    if len(symbols) != symbols_count or len(codes) > 0 and (min(codes) < 0 or max(codes) >= alphabet_size):
+        raise ValueError("Broken symbol codes")
+    if len(table) > 0 and (min(table) < CompiledDFA.DEAD_STATE or max(table) >= states_count):
+        raise ValueError("Broken transition table")
+    return CompiledDFA.from_tables(regex, dict(zip(symbols, codes)), alphabet_size, table, accepting)
+
+
+def dump_grammar(grammar):
+    # Symbols of compact form are already numbered, so they are written as is
+    compact = grammar.get_compact()
+    rules = array.array("I")
+    for left, right_set in compact.productions.items():
+        for right in sorted(right_set):
+            rules.append(left)
+            rules.append(len(right))
+            rules.extend(right)
+    names = []
+    for name in compact.symbols:
+        encoded = name.encode()
+        names.append(NAME_LENGTH.pack(len(encoded)) + encoded)
+    return b"".join([GRAMMAR_MAGIC, GRAMMAR_HEADER.pack(len(compact.symbols), compact.start, len(rules))] + names +
+                    [rules.tobytes()])
+
+
+def load_grammar(data):
+    offset = _check_magic(data, GRAMMAR_MAGIC)
+    symbols_count, start, rules_length = GRAMMAR_HEADER.unpack_from(data, offset)
+    offset += GRAMMAR_HEADER.size
+    compact = CompactGrammar()
+    for i in range(symbols_count):
+        length, = NAME_LENGTH.unpack_from(data, offset)
+        offset += NAME_LENGTH.size
+        if compact.intern(bytes(data[offset:offset + length]).decode()) != i:
+            raise ValueError("Duplicate symbol")
+        offset += length
+    rules, offset = _read_array(data, offset, "I", rules_length)
+    if start >= symbols_count:
+        raise ValueError("Broken start symbol")
+
+    compact.start = start
+    compact.productions[start] = set()
+    i = 0
+    while i < len(rules):
+        if i + 1 >= len(rules):
+            raise ValueError("Truncated rule")
+        left, length = rules[i], rules[i + 1]
+        right = tuple(rules[i + 2:i + 2 + length])
+        if len(right) != length or max(right + (left,)) >= symbols_count:
+            raise ValueError("Broken rule")
+        compact.productions.setdefault(left, set()).add(right)
+        i += 2 + length
+    res = compact.to_cfg()
+    # Only grammars in Chomsky Normal Form are cached
+    res.chomsky_form = res
+    return res
+
+
+def _check_magic(data, magic):
+    if data[:len(magic)] != magic:
+        raise ValueError("Not a cache file")
+    return len(magic)
+
+
+def _read_array(data, offset, typecode, count):
+    res = array.array(typecode)
+    end = offset + count * res.itemsize
+    if end > len(data):
+        raise ValueError("Truncated array")
+    # Slice of memoryview is not a copy, frombytes makes the only one
+    res.frombytes(data[offset:end])
+    return res, end
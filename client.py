@@ -0,0 +1,157 @@
+from main import read_production_rules, read_words, write_answers
+
+__author__ = 'drack3800'
+
+import argparse
+import asyncio
+import itertools
+import json
+import sys
+
+"""
+Client of matching service (see server.py)
+Usage: python client.py --socket PATH regex grammar_file [num_of_tests] < words
+It answers like main.py, but regex and grammar are compiled by the server once for all clients.
+"""
+
+# Words per query and queries sent before waiting for answers
+QUERY_SIZE = 1024
+MAX_PENDING = 16
+
+
+class MatchClient():
+    """
+    Example:
+        client = await MatchClient.connect_unix("/tmp/match.sock")
+        pair = await client.register("ab+*", [("S", "a S b"), ("S", "")])
+        answers = await client.query(pair, ["ab", "ba"])
+    Requests can be sent concurrently from many tasks, answers are matched by request id.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count(1)
+        # request id -> future of response
+        self.pending = {}
+        self.reading = asyncio.ensure_future(self.__read_responses())
+
+    @staticmethod
+    async def connect_unix(path):
+        reader, writer = await asyncio.open_unix_connection(path, limit=1 << 24)
+        return MatchClient(reader, writer)
+
+    @staticmethod
+    async def connect_tcp(host, port):
+        reader, writer = await asyncio.open_connection(host, port, limit=1 << 24)
+        return MatchClient(reader, writer)
+
+    async def register(self, regex, production_rules, engine=None, automaton=None, product=False):
+        request = {"op": "register", "regex": regex, "grammar": [list(rule) for rule in production_rules]}
+        if engine is not None:
+            request["engine"] = engine
+        if automaton is not None:
+            request["automaton"] = automaton
+        if product:
+            request["product"] = True
+        return (await self.request(request))["pair"]
+
+    async def query(self, pair, words):
+        return (await self.request({"op": "query", "pair": pair, "words": list(words)}))["answers"]
+
+    async def get_stats(self):
+        return (await self.request({"op": "stats"}))["stats"]
+
+    async def request(self, request):
+        request["id"] = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request["id"]] = future
+        self.writer.write(json.dumps(request).encode() + b"\n")
+        await self.writer.drain()
+        response = await future
+        if not response.get("ok"):
+            raise RuntimeError(response.get("error"))
+        return response
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        await self.reading
+
+    async def __read_responses(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            response = json.loads(line)
+            future = self.pending.pop(response.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(response)
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Connection is closed"))
+        self.pending = {}
+
+
+async def connect(args):
+    if args.socket is not None:
+        return await MatchClient.connect_unix(args.socket)
+    return await MatchClient.connect_tcp(args.host, args.port)
+
+
+async def check_words(client, pair, words):
+    """
+    Generator of answers for words, in the same order
+    Up to MAX_PENDING queries of QUERY_SIZE words are sent before waiting for the first answer.
+    """
+    words = iter(words)
+    pending = []
+    while True:
+        chunk = list(itertools.islice(words, QUERY_SIZE))
+        if len(chunk) > 0:
+            pending.append(asyncio.ensure_future(client.query(pair, chunk)))
+        if len(pending) > 0 and (len(pending) >= MAX_PENDING or len(chunk) == 0):
+            for answer in await pending.pop(0):
+                yield answer
+        elif len(chunk) == 0:
+            return
+
+
+def add_address_arguments(parser):
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument("--socket", help="path of Unix socket of server")
+    address.add_argument("--port", type=int, help="TCP port of server")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP host of server")
+
+
+async def run(args):
+    with open(args.grammar_file, 'r') as grammar_file:
+        production_rules = read_production_rules(grammar_file)
+    client = await connect(args)
+    try:
+        pair = await client.register(args.regex, production_rules, args.engine, args.automaton, args.product)
+        words = read_words(sys.stdin.buffer)
+        if args.num_of_tests is not None:
+            words = itertools.islice(words, args.num_of_tests)
+        answers = [answer async for answer in check_words(client, pair, words)]
+    finally:
+        await client.close()
+    write_answers(answers, sys.stdout.buffer)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks words from stdin for membership in L(regex) and L(grammar) "
+                                                 "with matching server")
+    add_address_arguments(parser)
+    parser.add_argument("regex", help="regular expression in postfix notation")
+    parser.add_argument("grammar_file", help="file with grammar rules")
+    parser.add_argument("num_of_tests", type=int, nargs="?", default=None,
+                        help="number of words to check, by default all words until EOF")
+    parser.add_argument("--engine", default=None, help="how to check grammar, see main.py")
+    parser.add_argument("--automaton", default=None, help="how to match regex, see main.py")
+    parser.add_argument("--product", action="store_true", help="check words against grammar of the intersection")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
-import copy
+import heapq
 import re
-import random
-import string
-import uuid
+
+import parallel
+import stats
 
 __author__ = 'drack3800'
 
@@ -14,6 +14,8 @@ Non-terminals and terminals must be splitted in a rule: A -> A42 b C067 d e F (i
 
 NONTERMINAL_REGEX = re.compile("[A-Z][0-9]*")
 TERMINAL_REGEX = re.compile("[a-z]")
+# Letter of non-terminals generated by grammar transformations
+NEW_NON_TERMINAL_LETTER = "X"
 
 def is_terminal(word):
     return TERMINAL_REGEX.fullmatch(word) is not None
@@ -21,14 +23,32 @@ def is_terminal(word):
 def is_non_terminal(word):
     return NONTERMINAL_REGEX.fullmatch(word) is not None
 
+
 class CFG():
     """
     productions is a list of tuples or dict: [("A", "A b A b"), ("A", "a")]
     But self.productions is a dict of sets {"A": {"A b A b", "a"}}
+    Algorithms run on compact form of grammar with interned symbols (see CompactGrammar, get_compact()),
+    strings are only the interface.
+
+    engine selects algorithm of accept_word:
+    CYK converts grammar to Chomsky Normal Form and runs CYK algorithm (see CYKRecognizer),
+    INCREMENTAL runs CYK algorithm too, but reuses the chart for common prefixes of words (see IncrementalCYK),
+    EARLEY runs Earley algorithm on the grammar itself (see EarleyRecognizer).
     """
 
-    def __init__(self, start, productions):
+    CYK = "cyk"
+    INCREMENTAL = "incremental"
+    EARLEY = "earley"
+    ENGINES = (CYK, INCREMENTAL, EARLEY)
+
+    def __init__(self, start, productions, engine=CYK):
+        if engine not in CFG.ENGINES:
+            raise ValueError("Unknown engine {0}".format(engine))
+        self.engine = engine
         self.chomsky_form = None
+        self.recognizer = None
+        self.compact = None
         if not is_non_terminal(start):
             raise SyntaxError("Invalid start non-terminal {0}".format(start))
         self.start = start
@@ -41,189 +61,766 @@ class CFG():
             else:
                 self.productions[left].add(right.strip())
 
-    """
-    Return new grammar object with the same language in Chomsky Normal Form
-    Help: http://courses.cs.washington.edu/courses/cse322/09sp/lec14.pdf
-    """
+    def get_compact(self):
+        # Built once, so productions must not be changed after the first call
+        if self.compact is None:
+            self.compact = CompactGrammar.from_cfg(self)
+        return self.compact
 
     def get_in_cnf(self):
-        def add_new_start_state():
-            res.start = CFG.__generate_non_terminal()
-            res.productions[res.start] = {self.start}
+        """
+        Return new grammar object with the same language in Chomsky Normal Form
+        (see CompactGrammar.get_in_cnf)
+        """
+        res = self.get_compact().get_in_cnf().to_cfg(self.engine)
+        res.chomsky_form = res
+        return res
 
-        def eliminate_one_epsilon_rule():
-            epsilon_rule = None
-            for left, right_set in res.productions.items():
-                if "" in right_set:
-                    epsilon_rule = left
-            if epsilon_rule is None:
-                return False
+    def simplify(self):
+        """
+        Return new grammar object with the same language without useless and duplicate non-terminals
+        (see CompactGrammar.simplify)
+        """
+        return self.get_compact().simplify().to_cfg(self.engine)
 
-            # Delete epsilon rule
-            res.productions[epsilon_rule].remove("")
-            # Find occurrences
-            rules_to_add = []
-            for left, right_set in res.productions.items():
-                for right in right_set:
-                    processed = ''.join(right.split(epsilon_rule))
-                    if processed != right:
-                        rules_to_add.append((left, right))
-            # Adding
-            for left, right in rules_to_add:
-                right_splitted = right.split()
-                for i in range(len(right_splitted)):
-                    if right_splitted[i] == epsilon_rule:
-                        if i + 1 < len(right_splitted):
-                            res.productions[left].add(' '.join(right_splitted[:i] + right_splitted[i+1:]))
-                        else:
-                            res.productions[left].add(' '.join(right_splitted[:i]))
-            return True
+    def get_size(self):
+        """
+        Return tuple (number of non-terminals with rules, number of rules, total length of rules)
+        """
+        return self.get_compact().get_size()
 
-        def eliminate_epsilon_rules():
-            while eliminate_one_epsilon_rule():
-                pass
+    def is_in_cnf(self):
+        return self.get_compact().is_in_cnf()
 
-        def eliminate_one_unit_rule():
-            unit_rule = None
-            for left, right_set in res.productions.items():
-                # if left != res.start:
-                    for right in right_set:
-                        if is_non_terminal(right):
-                            unit_rule = (left, right)
-            if unit_rule is None:
-                return False
+    def accept_word(self, word):
+        return self.get_recognizer().accept_word(word)
 
-            left, right = unit_rule
-            # Remove this unit rule (A -> B)
-            res.productions[left].remove(right)
-            # And replace it by rules (B -> u)
-            for right_right in res.productions.get(right, {}):
-                res.productions[left].add(right_right)
+    def accept_words(self, words, jobs=1):
+        # Grammar is converted to CNF and compiled once and shared by all jobs
+        return self.get_recognizer().accept_words(words, jobs)
 
-        def eliminate_unit_rules():
-            while eliminate_one_unit_rule():
-                pass
+    def get_recognizer(self):
+        if self.recognizer is None:
+            if self.engine == CFG.EARLEY:
+                self.recognizer = EarleyRecognizer(self)
+            else:
+                if self.chomsky_form is None:
+                    self.chomsky_form = self.get_in_cnf()
+                if self.engine == CFG.INCREMENTAL:
+                    self.recognizer = IncrementalCYK(self.chomsky_form)
+                else:
+                    self.recognizer = CYKRecognizer(self.chomsky_form)
+        return self.recognizer
 
-        def eliminate_one_long_rule():
-            long_rule = None
-            for left, right_set in res.productions.items():
-                for right in right_set:
-                    splitted = right.split()
-                    if len(splitted) > 2:
-                        long_rule = (left, right)
-            if long_rule is None:
-                return False
+    def get_terminals(self):
+        compact = self.get_compact()
+        return {compact.symbols[terminal] for terminal in compact.get_terminals()}
 
-            left, right = long_rule
-            splitted_right = right.split()
-            rest_of_right = splitted_right[1:]
-            new_non_terminal = CFG.__generate_non_terminal()
-            res.productions[left].remove(right)
-            res.productions[left].add(' '.join([splitted_right[0], new_non_terminal]))
-            res.productions[new_non_terminal] = {' '.join(rest_of_right)}
-            return True
-
-        def process_rules_of_length_two():
-            # Collect needed rules
-            rules_to_process = set()
-            for left, right_set in res.productions.items():
-                for right in right_set:
-                    splitted = right.split()
-                    if len(splitted) == 2:
-                        rules_to_process.add((left, right))
-            # Process rules length of two. There are no long rules so far.
-            for left, right in rules_to_process:
-                splitted = right.split()
-                if len(splitted) == 2:
-                    cond1 = is_terminal(splitted[0])  # first piece is terminal
-                    cond2 = is_terminal(splitted[1])   # second piece is terminal
-                    if cond1 and cond2:     # both pieces are terminals
-                        new_non_terminal_0 = CFG.__generate_non_terminal()
-                        new_non_terminal_1 = CFG.__generate_non_terminal()
-                        res.productions[new_non_terminal_0] = {splitted[0]}
-                        res.productions[new_non_terminal_1] = {splitted[1]}
-                        res.productions[left].remove(right)
-                        res.productions[left].add(' '.join([new_non_terminal_0, new_non_terminal_1]))
-                    elif cond1:
-                        new_non_terminal = res.__generate_non_terminal()
-                        res.productions[new_non_terminal] = {splitted[0]}
-                        res.productions[left].remove(right)
-                        res.productions[left].add(' '.join([new_non_terminal, splitted[1]]))
-                    elif cond2:
-                        new_non_terminal = res.__generate_non_terminal()
-                        res.productions[new_non_terminal] = {splitted[1]}
-                        res.productions[left].remove(right)
-                        res.productions[left].add(' '.join([splitted[0], new_non_terminal]))
+    def is_empty(self):
+        return self.get_min_word_length() is None
 
+    def get_min_word_length(self):
+        """
+        Return length of the shortest word derivable from start or None if language is empty
+        """
+        return self.get_compact().get_min_word_length()
 
-        def eliminate_long_rules():
-            while eliminate_one_long_rule():
-                pass
-            process_rules_of_length_two()
-
-        res = copy.deepcopy(self)
-        add_new_start_state()
-        eliminate_epsilon_rules()
-        eliminate_unit_rules()
-        eliminate_long_rules()
+    def __str__(self):
+        res = "start: " + self.start + "\n"
+        for left, right_set in self.productions.items():
+            for right in right_set:
+                res += "\"{0}\" -> \"{1}\"\n".format(left, right)
+        return res
+
+
+"""
+CompactGrammar is a grammar with interned symbols, all algorithms on grammars work with it
+"""
+
+
+class CompactGrammar():
+    """
+    Symbols are small integers: self.symbols[i] is name of symbol i, self.symbol_ids[name] is i,
+    self.kinds[i] is NON_TERMINAL, TERMINAL or OTHER (neither regex matches, it is treated as terminal).
+    Rules are tuples of symbols: self.productions[left] is a set of tuples (index by left part),
+    get_occurrences() is index by right part. Names are only needed to convert grammar back (see to_cfg()).
+    """
+
+    __slots__ = ("symbols", "symbol_ids", "kinds", "start", "productions", "fresh_count")
+
+    NON_TERMINAL = 0
+    TERMINAL = 1
+    OTHER = 2
+
+    def __init__(self):
+        self.symbols = []
+        self.symbol_ids = {}
+        self.kinds = bytearray()
+        self.start = None
+        self.productions = {}
+        # Number of the last fresh non-terminal (see new_non_terminal())
+        self.fresh_count = 0
+
+    @staticmethod
+    def from_cfg(grammar):
+        res = CompactGrammar()
+        res.start = res.intern(grammar.start)
+        for left, right_set in grammar.productions.items():
+            res.productions[res.intern(left)] = {tuple(res.intern(part) for part in right.split())
+                                                 for right in right_set}
+        return res
+
+    def to_cfg(self, engine=CFG.CYK):
+        res = CFG(self.symbols[self.start], [], engine)
+        res.productions = {self.symbols[left]: {' '.join(self.symbols[part] for part in right) for right in right_set}
+                           for left, right_set in self.productions.items()}
+        res.compact = self
         return res
 
+    def intern(self, name):
+        # Regexes are matched once per symbol, not once per occurrence
+        symbol = self.symbol_ids.get(name)
+        if symbol is None:
+            symbol = len(self.symbols)
+            self.symbols.append(name)
+            self.symbol_ids[name] = symbol
+            if is_non_terminal(name):
+                self.kinds.append(CompactGrammar.NON_TERMINAL)
+            elif is_terminal(name):
+                self.kinds.append(CompactGrammar.TERMINAL)
+            else:
+                self.kinds.append(CompactGrammar.OTHER)
+        return symbol
+
+    def is_non_terminal(self, symbol):
+        return self.kinds[symbol] == CompactGrammar.NON_TERMINAL
+
+    def copy(self, productions=None):
+        # The copy has its own symbol table, so new symbols of the copy do not change this grammar
+        res = CompactGrammar()
+        res.symbols = list(self.symbols)
+        res.symbol_ids = dict(self.symbol_ids)
+        res.kinds = bytearray(self.kinds)
+        res.start = self.start
+        res.fresh_count = self.fresh_count
+        if productions is None:
+            productions = {left: set(right_set) for left, right_set in self.productions.items()}
+        res.productions = productions
+        return res
+
+    def get_rules_count(self):
+        return sum(len(right_set) for right_set in self.productions.values())
+
+    def get_size(self):
+        length = sum(len(right) for right_set in self.productions.values() for right in right_set)
+        return len(self.productions), self.get_rules_count(), length
+
+    def get_terminals(self):
+        terminals = set()
+        for right_set in self.productions.values():
+            for right in right_set:
+                terminals.update(part for part in right if not self.is_non_terminal(part))
+        return terminals
+
+    def get_occurrences(self):
+        """
+        Return dict: symbol -> list of (left, right) rules which have symbol in right part, once per occurrence
+        """
+        occurrences = {}
+        for left, right_set in self.productions.items():
+            for right in right_set:
+                for part in right:
+                    occurrences.setdefault(part, []).append((left, right))
+        return occurrences
+
+    def get_nullable(self):
+        """
+        Return set of nullable non-terminals
+        """
+        return self.__get_derivable(lambda part: False)
+
+    def get_productive(self):
+        """
+        Return set of non-terminals which derive some word
+        """
+        return self.__get_derivable(lambda part: not self.is_non_terminal(part))
+
+    def __get_derivable(self, is_derived):
+        # Worklist fixpoint: rule makes its left part derivable when all its other parts are derivable
+        derivable = set()
+        worklist = []
+        remaining = {}
+        for left, right_set in self.productions.items():
+            for right in right_set:
+                remaining[(left, right)] = sum(1 for part in right if not is_derived(part))
+                if remaining[(left, right)] == 0 and left not in derivable:
+                    derivable.add(left)
+                    worklist.append(left)
+        occurrences = self.get_occurrences()
+        while len(worklist) > 0:
+            symbol = worklist.pop()
+            for rule in occurrences.get(symbol, []):
+                remaining[rule] -= 1
+                if remaining[rule] == 0 and rule[0] not in derivable:
+                    derivable.add(rule[0])
+                    worklist.append(rule[0])
+        return derivable
+
+    def get_min_word_length(self):
+        """
+        Return length of the shortest word derivable from start or None if language is empty
+        Knuth's generalization of Dijkstra's algorithm: non-terminals are settled in order of their lengths,
+        and rule gives a length to its left part when all non-terminals of its right part are settled.
+        """
+        # (left, right) -> [number of non-terminals not settled yet, length of settled parts]
+        remaining = {}
+        heap = []
+        for left, right_set in self.productions.items():
+            for right in right_set:
+                count = sum(1 for part in right if self.is_non_terminal(part))
+                remaining[(left, right)] = [count, len(right) - count]
+                if count == 0:
+                    heap.append((len(right), left))
+        heapq.heapify(heap)
+        occurrences = self.get_occurrences()
+        lengths = {}
+        while len(heap) > 0:
+            length, symbol = heapq.heappop(heap)
+            if symbol in lengths:
+                continue
+            lengths[symbol] = length
+            if symbol == self.start:
+                break
+            for rule in occurrences.get(symbol, []):
+                state = remaining[rule]
+                state[0] -= 1
+                state[1] += length
+                if state[0] == 0 and rule[0] not in lengths:
+                    heapq.heappush(heap, (state[1], rule[0]))
+        return lengths.get(self.start)
+
+    def simplify(self):
+        """
+        Return new grammar of the same language without:
+        - rules with non-terminals which derive no word
+        - non-terminals unreachable from start
+        - duplicate non-terminals: if A and B have equal sets of rules, B is replaced by A everywhere
+        Start symbol is kept even if its language is empty, and it is never merged with other symbols.
+        """
+        productive = self.get_productive()
+        productions = {self.start: set()}
+        stack = [self.start]
+        while len(stack) > 0:
+            left = stack.pop()
+            for right in self.productions.get(left, set()):
+                if all(part in productive or not self.is_non_terminal(part) for part in right):
+                    productions[left].add(right)
+                    for part in right:
+                        if self.is_non_terminal(part) and part not in productions:
+                            productions[part] = set()
+                            stack.append(part)
+
+        # Merging can make more rule sets equal (A -> B a, C -> D a after B = D), so it is repeated until fixpoint
+        while True:
+            representatives = {}
+            renames = {}
+            for left in sorted(productions.keys()):
+                if left == self.start:
+                    continue
+                key = frozenset(productions[left])
+                if key in representatives:
+                    renames[left] = representatives[key]
+                else:
+                    representatives[key] = left
+            if len(renames) == 0:
+                return self.copy(productions)
+            productions = {left: {tuple(renames.get(part, part) for part in right) for right in right_set}
+                           for left, right_set in productions.items() if left not in renames}
+
     def is_in_cnf(self):
-        for left, right_set in self.productions:
+        for left, right_set in self.productions.items():
+            if not self.is_non_terminal(left):
+                return False
             for right in right_set:
-                splitted = right.split()
-                if right == self.start or not is_non_terminal(left):
+                if self.start in right:
                     return False
-                elif len(splitted) == 1:
-                    # Must be terminal symbol
-                    if not is_terminal(right) or right == "":
+                elif len(right) == 0:
+                    # Only start symbol can derive empty word
+                    if left != self.start:
+                        return False
+                elif len(right) == 1:
+                    # Must be terminal symbol (OTHER symbols are terminals too)
+                    if self.is_non_terminal(right[0]):
                         return False
-                elif len(splitted) > 2:
+                elif len(right) > 2:
                     return False
-                elif not is_non_terminal(splitted[0]) or not is_non_terminal(splitted[1]):
+                elif not self.is_non_terminal(right[0]) or not self.is_non_terminal(right[1]):
                     return False
         return True
 
+    """
+    Return new grammar with the same language in Chomsky Normal Form
+    Help: http://courses.cs.washington.edu/courses/cse322/09sp/lec14.pdf
+
+    Steps go in order START, TERM, BIN, DEL, UNIT, so the result grows linearly with grammar
+    (except UNIT, which is quadratic in the worst case).
+    Useless and duplicate non-terminals are removed before and after (see simplify()).
+    """
+
+    def get_in_cnf(self):
+        def add_new_start_state():
+            start = res.start
+            res.start = res.new_non_terminal()
+            res.productions[res.start] = {(start,)}
+
+        def lift_terminals():
+            # Terminals in rules of length >= 2 are replaced by shared non-terminals T -> a
+            terminal_non_terminals = {}
+            for left in list(res.productions.keys()):
+                right_set = res.productions[left]
+                for right in sorted(right_set):
+                    if len(right) < 2 or all(res.is_non_terminal(part) for part in right):
+                        continue
+                    lifted = []
+                    for part in right:
+                        if not res.is_non_terminal(part):
+                            if part not in terminal_non_terminals:
+                                terminal_non_terminals[part] = res.new_non_terminal()
+                                res.productions[terminal_non_terminals[part]] = {(part,)}
+                            part = terminal_non_terminals[part]
+                        lifted.append(part)
+                    right_set.remove(right)
+                    right_set.add(tuple(lifted))
+
+        def eliminate_long_rules():
+            # A -> B1 B2 ... Bk becomes A -> B1 N1, N1 -> B2 N2, ..., Nk-2 -> Bk-1 Bk
+            # Ni stands for the tail Bi+1 ... Bk, equal tails of different rules share it
+            tails = {}
+            for left in list(res.productions.keys()):
+                right_set = res.productions[left]
+                for right in sorted(right_set):
+                    if len(right) <= 2:
+                        continue
+                    right_set.remove(right)
+                    current = left
+                    for i in range(len(right) - 2):
+                        tail = right[i + 1:]
+                        known = tail in tails
+                        if not known:
+                            tails[tail] = res.new_non_terminal()
+                        res.productions.setdefault(current, set()).add((right[i], tails[tail]))
+                        current = tails[tail]
+                        if known:
+                            break
+                    else:
+                        res.productions[current] = {right[-2:]}
+
+        def eliminate_epsilon_rules():
+            nullable = res.get_nullable()
+            for left, right_set in res.productions.items():
+                right_set.discard(())
+                for right in list(right_set):
+                    # There are only rules of length <= 2 so far
+                    if len(right) == 2:
+                        if right[0] in nullable:
+                            right_set.add(right[1:])
+                        if right[1] in nullable:
+                            right_set.add(right[:1])
+            if res.start in nullable:
+                res.productions[res.start].add(())
+
+        def is_unit_rule(right):
+            return len(right) == 1 and res.is_non_terminal(right[0])
+
+        def eliminate_unit_rules():
+            # A gets all non-unit rules of every B such that A =>* B by unit rules
+            unit_rules = {}
+            for left, right_set in res.productions.items():
+                unit_rules[left] = sorted(right[0] for right in right_set if is_unit_rule(right))
+            new_productions = {}
+            for left, right_set in res.productions.items():
+                reachable = {left}
+                stack = [left]
+                while len(stack) > 0:
+                    for right in unit_rules.get(stack.pop(), []):
+                        if right not in reachable:
+                            reachable.add(right)
+                            stack.append(right)
+                new_productions[left] = set()
+                for symbol in reachable:
+                    new_productions[left].update(right for right in res.productions.get(symbol, set())
+                                                 if not is_unit_rule(right))
+            res.productions = new_productions
+
+        def run_phase(name, phase):
+            # Wall-clock time of phase and number of rules after it go to stats
+            with stats.timer("cnf." + name):
+                phase()
+            if stats.enabled:
+                stats.add("cnf.rules." + name, res.get_rules_count())
+
+        def simplify_rules():
+            simplified = res.simplify()
+            res.productions = simplified.productions
+
+        res = self.copy()
+        if stats.enabled:
+            stats.add("cnf.rules.input", res.get_rules_count())
+        run_phase("prune", simplify_rules)
+        run_phase("start", add_new_start_state)
+        run_phase("term", lift_terminals)
+        run_phase("bin", eliminate_long_rules)
+        run_phase("del", eliminate_epsilon_rules)
+        run_phase("unit", eliminate_unit_rules)
+        run_phase("simplify", simplify_rules)
+        return res
+
+    def new_non_terminal(self):
+        """
+        Return fresh non-terminal X1, X2, ... which is not used in grammar
+        Names are deterministic, so the same grammar always gets the same Chomsky Normal Form
+        """
+        while True:
+            self.fresh_count += 1
+            name = NEW_NON_TERMINAL_LETTER + str(self.fresh_count)
+            if name not in self.symbol_ids:
+                return self.intern(name)
+
+
+"""
+CYKRecognizer is a compiled form of grammar in Chomsky Normal Form for CYK algorithm
+"""
+
+
+class CYKRecognizer():
+    """
+    Initializes with grammar in Chomsky Normal Form
+
+    Non-terminals are numbered and a set of non-terminals is an integer bitmask.
+    self.terminal_masks[a] is the mask of non-terminals A with rule A -> a
+    self.pair_rules is a list of (B, C, mask of non-terminals A with rule A -> B C)
+    """
+
+    def __init__(self, grammar):
+        compact = grammar.get_compact()
+        non_terminals = set(compact.productions.keys())
+        for right_set in compact.productions.values():
+            for right in right_set:
+                non_terminals.update(part for part in right if compact.is_non_terminal(part))
+        # Bits are given to non-terminals in order of names, so the same grammar gets the same recognizer
+        non_terminals = sorted(non_terminals, key=compact.symbols.__getitem__)
+        self.non_terminal_ids = {compact.symbols[symbol]: i for i, symbol in enumerate(non_terminals)}
+        bits = {symbol: i for i, symbol in enumerate(non_terminals)}
+        self.start = bits[compact.start]
+        self.accepts_empty_word = () in compact.productions.get(compact.start, set())
+
+        self.terminal_masks = {}
+        pair_masks = {}
+        for left, right_set in compact.productions.items():
+            bit = 1 << bits[left]
+            for right in right_set:
+                if len(right) == 1 and not compact.is_non_terminal(right[0]):
+                    terminal = compact.symbols[right[0]]
+                    self.terminal_masks[terminal] = self.terminal_masks.get(terminal, 0) | bit
+                elif len(right) == 2:
+                    pair = (bits[right[0]], bits[right[1]])
+                    pair_masks[pair] = pair_masks.get(pair, 0) | bit
+        self.pair_rules = [(left, right, mask) for (left, right), mask in sorted(pair_masks.items())]
+
     def accept_word(self, word):
-        if self.chomsky_form is None:
-            self.chomsky_form = self.get_in_cnf()
-        # CYK algorithm
-        grammar = self.chomsky_form
+        """
+        Bit-parallel CYK algorithm
+        ends[A][i] has bit k set iff A derives word[i:k]
+        starts[A][j] has bit k set iff A derives word[k:j]
+        So rule A -> B C derives word[i:j] iff ends[B][i] & starts[C][j] != 0
+        and all split points are checked with one bitwise operation.
+        """
         if word == "":
-            if "" in grammar.productions[grammar.start]:
-                return True
-            else:
-                return False
+            return self.accepts_empty_word
         n = len(word)
-        # Init table
-        T = {non_terminal: [[False for i in range(n + 1)] for j in range(n + 1)] for non_terminal in grammar.productions.keys()}
+        # With stats rule checks are counted in a separate copy of the inner loop, so the usual one stays as is
+        counting = stats.enabled
+        rule_checks = 0
+        count = len(self.non_terminal_ids)
+        ends = [[0] * (n + 1) for i in range(count)]
+        starts = [[0] * (n + 1) for i in range(count)]
+        # cell[i] is the mask of non-terminals which derive word[i:i + l] for current length l
+        cell = []
         for i in range(n):
-            x = word[i]
-            for left, right_set in grammar.productions.items():
-                if x in right_set:
-                    T[left][i][i + 1] = True
+            mask = self.terminal_masks.get(word[i], 0)
+            cell.append(mask)
+            while mask:
+                low = mask & -mask
+                a = low.bit_length() - 1
+                ends[a][i] |= 1 << (i + 1)
+                starts[a][i + 1] |= 1 << i
+                mask ^= low
         for l in range(2, n + 1):
+            cell = []
             for i in range(n - l + 1):
                 j = i + l
-                for left, right_set in grammar.productions.items():
-                    for right in right_set:
-                        splitted = right.split()
-                        if len(splitted) == 2:
-                            for k in range(i + 1, j):
-                                if T[splitted[0]][i][k] and T[splitted[1]][k][j]:
-                                    T[left][i][j] = True
-        return T[grammar.start][0][n]
+                mask = 0
+                if counting:
+                    for left, right, heads in self.pair_rules:
+                        if heads & ~mask:
+                            rule_checks += 1
+                            if ends[left][i] & starts[right][j]:
+                                mask |= heads
+                else:
+                    for left, right, heads in self.pair_rules:
+                        if heads & ~mask and ends[left][i] & starts[right][j]:
+                            mask |= heads
+                cell.append(mask)
+                # Cells of the same length never split each other, so tables can be updated right away
+                while mask:
+                    low = mask & -mask
+                    a = low.bit_length() - 1
+                    ends[a][i] |= 1 << j
+                    starts[a][j] |= 1 << i
+                    mask ^= low
+        if counting:
+            stats.add("cyk.words")
+            stats.add("cyk.cells", n * (n + 1) // 2)
+            stats.add("cyk.rule_checks", rule_checks)
+        return (cell[0] >> self.start) & 1 == 1
 
-    def __str__(self):
-        res = "start: " + self.start + "\n"
-        for left, right_set in self.productions.items():
-            for right in right_set:
-                res += "\"{0}\" -> \"{1}\"\n".format(left, right)
+    def accept_batch(self, words):
+        """
+        Return list of answers for list of words, in the same order
+        """
+        return [self.accept_word(word) for word in words]
+
+    def accept_words(self, words, jobs=1):
+        return parallel.accept_words(self, words, jobs)
+
+
+class IncrementalCYK(CYKRecognizer):
+    """
+    Initializes with grammar in Chomsky Normal Form
+
+    CYK algorithm which fills the chart column by column, left to right:
+    push(letter) appends letter to the current word and computes cells word[i:n] for all i,
+    pop() removes the last letter and its column. So words with common prefix share the chart:
+    accept_word(word) pops letters of the previous word up to the common prefix and pushes the rest.
+    accept_batch(words) checks words in sorted order, that is a depth-first walk over the trie of words,
+    so each trie node is pushed once.
+    """
+
+    def __init__(self, grammar):
+        CYKRecognizer.__init__(self, grammar)
+        self.reset()
+
+    def reset(self):
+        count = len(self.non_terminal_ids)
+        self.word = []
+        # Same tables as in CYKRecognizer.accept_word, starts[A][0] is an empty column
+        self.ends = [[] for i in range(count)]
+        self.starts = [[0] for i in range(count)]
+        # columns[j - 1][i] is the mask of non-terminals which derive word[i:j]
+        self.columns = []
+
+    def push(self, letter):
+        """
+        Append letter to the current word, return whether the new word is accepted
+        """
+        ends = self.ends
+        starts = self.starts
+        for a in range(len(ends)):
+            ends[a].append(0)
+            starts[a].append(0)
+        j = len(self.word) + 1
+        counting = stats.enabled
+        rule_checks = 0
+        column = [0] * j
+        mask = self.terminal_masks.get(letter, 0)
+        # Cells are computed from the shortest, so starts[C][j] is ready for all split points
+        for i in range(j - 1, -1, -1):
+            if i < j - 1:
+                mask = 0
+                if counting:
+                    for left, right, heads in self.pair_rules:
+                        if heads & ~mask:
+                            rule_checks += 1
+                            if ends[left][i] & starts[right][j]:
+                                mask |= heads
+                else:
+                    for left, right, heads in self.pair_rules:
+                        if heads & ~mask and ends[left][i] & starts[right][j]:
+                            mask |= heads
+            column[i] = mask
+            while mask:
+                low = mask & -mask
+                a = low.bit_length() - 1
+                ends[a][i] |= 1 << j
+                starts[a][j] |= 1 << i
+                mask ^= low
+        if counting:
+            stats.add("cyk.cells", j)
+            stats.add("cyk.rule_checks", rule_checks)
+        self.word.append(letter)
+        self.columns.append(column)
+        return self.is_accepted()
+
+    def pop(self):
+        """
+        Remove the last letter of the current word
+        """
+        j = len(self.word)
+        ends = self.ends
+        for i, mask in enumerate(self.columns.pop()):
+            while mask:
+                low = mask & -mask
+                ends[low.bit_length() - 1][i] ^= 1 << j
+                mask ^= low
+        for a in range(len(ends)):
+            ends[a].pop()
+            self.starts[a].pop()
+        self.word.pop()
+
+    def is_accepted(self):
+        if len(self.word) == 0:
+            return self.accepts_empty_word
+        return (self.columns[-1][0] >> self.start) & 1 == 1
+
+    def accept_word(self, word):
+        if stats.enabled:
+            stats.add("cyk.words")
+        common = 0
+        for letter, previous_letter in zip(word, self.word):
+            if letter != previous_letter:
+                break
+            common += 1
+        while len(self.word) > common:
+            self.pop()
+        for letter in word[common:]:
+            self.push(letter)
+        return self.is_accepted()
+
+    def accept_batch(self, words):
+        """
+        Return list of answers for words, in the same order
+        """
+        res = [False] * len(words)
+        for i in sorted(range(len(words)), key=words.__getitem__):
+            res[i] = self.accept_word(words[i])
         return res
 
-    @staticmethod
-    def __generate_non_terminal():
-        return random.choice(string.ascii_letters).capitalize() + str(uuid.uuid4())[:6]
+    def accept_words(self, words, jobs=1):
+        # Words are sorted within chunks, so prefixes are shared inside every chunk
+        return parallel.map_batches(self, "accept_batch", words, jobs)
+
+
+"""
+EarleyRecognizer is a compiled form of grammar for Earley algorithm
+"""
+
+
+class EarleyRecognizer():
+    """
+    Initializes with any grammar, no Chomsky Normal Form is needed
+
+    Earley algorithm (http://en.wikipedia.org/wiki/Earley_parser) with:
+    - Aycock and Horspool's handling of nullable non-terminals: predictor moves dot over nullable ones
+    - Leo's optimization of right recursion: chains of completions where each item is the only one waiting
+      for its non-terminal are replaced by their topmost item (Joop Leo, "A general context-free parsing
+      algorithm running in linear time on every LR(k) grammar without using lookahead", 1991)
+    So it runs in linear time on LR(k) grammars, quadratic on unambiguous ones and cubic in the worst case.
+
+    Item is a tuple (rule, dot, origin), self.rules[rule] is a tuple (left, right), right is a tuple of symbols
+    of CompactGrammar. Rule 0 is S' -> start, with S' = None.
+    """
+
+    def __init__(self, grammar):
+        compact = grammar.get_compact()
+        self.symbol_ids = compact.symbol_ids
+        self.rules = [(None, (compact.start,))]
+        self.rules_by_left = {}
+        for left in sorted(compact.productions.keys()):
+            for right in sorted(compact.productions[left]):
+                self.rules_by_left.setdefault(left, []).append(len(self.rules))
+                self.rules.append((left, right))
+        self.nullable = compact.get_nullable()
+        self.non_terminals = {symbol for symbol in range(len(compact.symbols)) if compact.is_non_terminal(symbol)}
+
+    def accept_word(self, word):
+        n = len(word)
+        rules = self.rules
+        # Letters are compared as symbols of grammar, unknown letters match nothing
+        word = [self.symbol_ids.get(char, -1) for char in word]
+        # items[i] is list of items of Earley set i, in order of adding, seen[i] is the same set
+        items = [[] for i in range(n + 1)]
+        seen = [set() for i in range(n + 1)]
+        # waiting[i][A] is list of items of set i with dot before A
+        waiting = [{} for i in range(n + 1)]
+        # leo[i][A] is topmost item for A in set i or None, computed on demand
+        leo = [{} for i in range(n + 1)]
+
+        def add(i, item):
+            if item not in seen[i]:
+                seen[i].add(item)
+                items[i].append(item)
+                right = rules[item[0]][1]
+                if item[1] < len(right):
+                    waiting[i].setdefault(right[item[1]], []).append(item)
+
+        def get_leo_item(i, symbol):
+            # Walk up the deterministic reduction path, then memoize the top for every step of it
+            path = []
+            top = None
+            while True:
+                if symbol in leo[i]:
+                    if leo[i][symbol] is not None:
+                        top = leo[i][symbol]
+                    break
+                waiting_items = waiting[i].get(symbol, [])
+                if len(waiting_items) != 1 or waiting_items[0][1] + 1 != len(rules[waiting_items[0][0]][1]):
+                    leo[i][symbol] = None
+                    break
+                path.append((i, symbol))
+                rule, dot, origin = waiting_items[0]
+                top = (rule, dot + 1, origin)
+                i, symbol = origin, rules[rule][0]
+            for i, symbol in path:
+                leo[i][symbol] = top
+            return top
+
+        add(0, (0, 0, 0))
+        for i in range(n + 1):
+            k = 0
+            while k < len(items[i]):
+                rule, dot, origin = items[i][k]
+                k += 1
+                left, right = rules[rule]
+                if dot == len(right):
+                    # Completer
+                    top = get_leo_item(origin, left) if origin < i else None
+                    if top is not None:
+                        add(i, top)
+                    else:
+                        for waiting_rule, waiting_dot, waiting_origin in list(waiting[origin].get(left, [])):
+                            add(i, (waiting_rule, waiting_dot + 1, waiting_origin))
+                elif right[dot] in self.non_terminals:
+                    # Predictor
+                    symbol = right[dot]
+                    for predicted_rule in self.rules_by_left.get(symbol, []):
+                        add(i, (predicted_rule, 0, i))
+                    if symbol in self.nullable:
+                        add(i, (rule, dot + 1, origin))
+                elif i < n and right[dot] == word[i]:
+                    # Scanner
+                    add(i + 1, (rule, dot + 1, origin))
+            if len(items[i]) == 0:
+                break
+        if stats.enabled:
+            stats.add("earley.words")
+            stats.add("earley.items", sum(len(items_set) for items_set in items))
+        return (0, 1, 0) in seen[n]
+
+    def accept_batch(self, words):
+        return [self.accept_word(word) for word in words]
+
+    def accept_words(self, words, jobs=1):
+        return parallel.accept_words(self, words, jobs)
 
 
 if __name__ == "__main__":
@@ -238,4 +835,6 @@ if __name__ == "__main__":
     a = CFG("S", prod)
     # print(a)
     # print('-'*15)
-    print(a.get_in_cnf())
+    cnf = a.get_in_cnf()
+    print(cnf)
+    print("size (non-terminals, rules, length): {0} -> {1}".format(a.get_size(), cnf.get_size()))
@@ -0,0 +1,228 @@
+from automata import DFA
+from grammar import CompactGrammar
+import parallel
+import stats
+
+__author__ = 'drack3800'
+
+"""
+LanguageIntersection answers whether word is in L(regex) and in L(grammar).
+Checks are ordered by cost, so cubic CYK runs only for words which passed all cheap checks:
+- "length": word is shorter than the shortest word of grammar
+- "alphabet": word has a letter which is not a terminal of grammar (one set operation)
+- "automaton": DFA rejects word (linear, a step per letter)
+- "grammar": CYK rejects word (cubic)
+
+build_intersection_grammar(automaton, grammar) builds grammar of the intersection language itself.
+"""
+
+STAGES = ("length", "alphabet", "automaton", "grammar")
+
+
+class LanguageIntersection():
+    """
+    Initializes with DFA (or CompiledDFA, LazyDFA, NFA) and CFG
+    Example: LanguageIntersection(DFA("ab+*"), CFG("S", [("S", "a S b"), ("S", "")]))
+
+    With filters=False only automaton and grammar checks are done.
+    With product=True grammar of the intersection is built once (see build_intersection_grammar)
+    and only it is checked, automaton is not needed anymore.
+    accept_words skips whole batches without checking words when the language is known to be empty:
+    with product=True that is emptiness of the intersection, otherwise only emptiness of grammar,
+    as the product is not built (is_empty() builds it on demand).
+    self.rejected[stage] is the number of words rejected by stage, self.accepted is the number of accepted words.
+    """
+
+    def __init__(self, automaton, grammar, filters=True, product=False):
+        if isinstance(automaton, DFA):
+            automaton = automaton.compile()
+        self.product_grammar = None
+        if product:
+            with stats.timer("intersection.product"):
+                self.product_grammar = build_intersection_grammar(automaton, grammar)
+            grammar = self.product_grammar
+            automaton = None
+        self.automaton = automaton
+        self.source_grammar = grammar
+        self.grammar = grammar.get_recognizer()
+
+        self.filters = filters
+        self.min_length = grammar.get_min_word_length()
+        if self.min_length is None:
+            # Empty language, nothing passes length check
+            self.min_length = float("inf")
+        self.alphabet = frozenset(grammar.get_terminals())
+
+        self.accepted = 0
+        self.rejected = {stage: 0 for stage in STAGES}
+
+    def get_rejecting_stage(self, word):
+        """
+        Return name of the first stage which rejects word or None if word is accepted
+        """
+        stage = self.__get_cheap_rejecting_stage(word)
+        if stage is None and not self.grammar.accept_word(word):
+            return "grammar"
+        return stage
+
+    def get_rejecting_stages(self, words):
+        """
+        Return list of get_rejecting_stage results for list of words
+        Words which pass cheap checks go to grammar together (accept_batch of recognizer),
+        so incremental CYK shares the chart between their common prefixes.
+        """
+        res = [None] * len(words)
+        passed = []
+        for i, word in enumerate(words):
+            res[i] = self.__get_cheap_rejecting_stage(word)
+            if res[i] is None:
+                passed.append(i)
+        answers = self.grammar.accept_batch([words[i] for i in passed])
+        for i, answer in zip(passed, answers):
+            if not answer:
+                res[i] = "grammar"
+        return res
+
+    def __get_cheap_rejecting_stage(self, word):
+        if self.filters and len(word) < self.min_length:
+            return "length"
+        if self.filters and not self.alphabet.issuperset(word):
+            return "alphabet"
+        if self.automaton is not None and not self.automaton.accept_word(word):
+            return "automaton"
+        return None
+
+    def is_empty(self):
+        if self.product_grammar is None:
+            with stats.timer("intersection.product"):
+                self.product_grammar = build_intersection_grammar(self.automaton, self.source_grammar)
+        return self.product_grammar.is_empty()
+
+    def accept_word(self, word):
+        stage = self.get_rejecting_stage(word)
+        self.__record(stage)
+        return stage is None
+
+    def accept_words(self, words, jobs=1):
+        if self.filters and self.min_length == float("inf"):
+            # Language is empty, no need to start workers.
+            # Without product it is the language of grammar, an empty intersection with nonempty grammar isn't seen.
+            for word in words:
+                self.__record("length")
+                yield False
+            return
+        # Stages are computed by workers in chunks, statistics are gathered here
+        for stage in parallel.map_batches(self, "get_rejecting_stages", words, jobs):
+            self.__record(stage)
+            yield stage is None
+
+    def __record(self, stage):
+        if stage is None:
+            self.accepted += 1
+        else:
+            self.rejected[stage] += 1
+
+    def __str__(self):
+        res = "accepted: {0}\n".format(self.accepted)
+        for stage in STAGES:
+            res += "rejected by {0}: {1}\n".format(stage, self.rejected[stage])
+        return res
+
+
+def build_intersection_grammar(automaton, grammar):
+    """
+    Return grammar in Chomsky Normal Form for L(automaton) & L(grammar) (Bar-Hillel construction)
+    Non-terminals of the result are triples (p, A, q): A derives word which leads automaton from p to q.
+    Only triples that derive some word (productive) and are reachable from start are kept.
+    """
+    if isinstance(automaton, DFA):
+        automaton = automaton.compile()
+    if grammar.chomsky_form is None:
+        grammar.chomsky_form = grammar.get_in_cnf()
+    grammar = grammar.chomsky_form.get_compact()
+
+    def go(state, symbol):
+        code = automaton.symbol_codes.get(grammar.symbols[symbol])
+        if code is None:
+            return automaton.DEAD_STATE
+        return automaton.table[state * automaton.alphabet_size + code]
+
+    # Binary rules A -> B C indexed by B and by C
+    by_left = {}
+    by_right = {}
+    terminal_rules = []
+    for left, right_set in grammar.productions.items():
+        for right in right_set:
+            if len(right) == 2:
+                by_left.setdefault(right[0], []).append((right[1], left))
+                by_right.setdefault(right[1], []).append((right[0], left))
+            elif len(right) == 1:
+                terminal_rules.append((left, right[0]))
+
+    # Productive triples are found bottom-up with worklist, every triple is processed once.
+    # When triple is processed, it is combined with all processed triples, so every pair is met once.
+    rules = {}
+    worklist = []
+
+    def add_rule(triple, right):
+        if triple not in rules:
+            rules[triple] = set()
+            worklist.append(triple)
+        rules[triple].add(right)
+
+    for left, terminal in terminal_rules:
+        for state in range(automaton.states_count):
+            target = go(state, terminal)
+            if target != automaton.DEAD_STATE:
+                add_rule((state, left, target), (terminal,))
+
+    # ends[(B, p)] is set of q such that (p, B, q) is processed, starts[(C, r)] is set of q for (q, C, r)
+    ends = {}
+    starts = {}
+    while len(worklist) > 0:
+        triple = worklist.pop()
+        p, symbol, q = triple
+        ends.setdefault((symbol, p), set()).add(q)
+        starts.setdefault((symbol, q), set()).add(p)
+        for right, left in by_left.get(symbol, []):
+            for r in ends.get((right, q), []):
+                add_rule((p, left, r), (triple, (q, right, r)))
+        for left_child, left in by_right.get(symbol, []):
+            for o in starts.get((left_child, p), []):
+                add_rule((o, left, q), ((o, left_child, p), triple))
+
+    # Keep triples reachable from start triples (0, S, f) for finish states f
+    start_triples = [(0, grammar.start, state) for state in range(automaton.states_count)
+                     if automaton.accepting[state] and (0, grammar.start, state) in rules]
+    reachable = set(start_triples)
+    stack = list(start_triples)
+    while len(stack) > 0:
+        for right in rules[stack.pop()]:
+            for part in right:
+                if isinstance(part, tuple) and part not in reachable:
+                    reachable.add(part)
+                    stack.append(part)
+
+    # Triples become new non-terminals, terminals keep their names
+    res = CompactGrammar()
+    res.start = res.intern("S")
+    symbols = {triple: res.intern("A" + str(i)) for i, triple in enumerate(sorted(reachable))}
+
+    def get_right(right):
+        return tuple(symbols[part] if isinstance(part, tuple) else res.intern(grammar.symbols[part]) for part in right)
+
+    # Start symbol gets rules of start triples, so it never appears in right parts
+    res.productions[res.start] = set()
+    for triple in start_triples:
+        for right in rules[triple]:
+            res.productions[res.start].add(get_right(right))
+    if () in grammar.productions.get(grammar.start, set()) and automaton.accepting[0]:
+        res.productions[res.start].add(())
+    for triple in reachable:
+        res.productions[symbols[triple]] = {get_right(right) for right in rules[triple]}
+
+    stats.add("intersection.product_triples", len(reachable))
+    res = res.to_cfg()
+    # Result is already in Chomsky Normal Form
+    res.chomsky_form = res
+    return res
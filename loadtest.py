@@ -0,0 +1,134 @@
+from benchmark import GRAMMAR_FAMILIES, generate_words, get_latency_metrics
+from client import connect
+
+__author__ = 'drack3800'
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+"""
+Load test of matching service (see server.py)
+Usage: python loadtest.py --socket PATH [--clients 8] [--queries 100] [--words 64] [--grammar dyck]
+       python loadtest.py --spawn [--jobs 4] ...
+
+Every client registers the same pair and sends queries of generated words (see benchmark.py),
+with up to --pipeline queries in flight. Result is JSON with throughput in words per second
+and latency percentiles of queries in seconds.
+With --spawn the server is started on a temporary Unix socket and stopped at the end.
+"""
+
+# Regex of the test pair accepts every word over letters of grammar families
+REGEX = "ab+lr+pm+x++*"
+
+
+async def run_client(args, production_rules, words_batches, latencies):
+    client = await connect(args)
+    try:
+        pair = await client.register(REGEX, production_rules, args.engine)
+        semaphore = asyncio.Semaphore(args.pipeline)
+
+        async def send(words):
+            async with semaphore:
+                start = time.perf_counter()
+                await client.query(pair, words)
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*[send(words) for words in words_batches])
+    finally:
+        await client.close()
+
+
+async def run(args):
+    family = {name: (production_rules, generate_word) for name, production_rules, generate_word in GRAMMAR_FAMILIES}
+    production_rules, generate_word = family[args.grammar]
+    rng = random.Random(args.seed)
+    letters = "".join(sorted({part for left, right in production_rules for part in right.split() if part.islower()}))
+    clients_batches = [[generate_words(generate_word, args.words, args.length, rng, letters)
+                        for i in range(args.queries)] for j in range(args.clients)]
+
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[run_client(args, production_rules, batches, latencies) for batches in clients_batches])
+    elapsed = time.perf_counter() - start
+
+    client = await connect(args)
+    try:
+        server_stats = await client.get_stats()
+    finally:
+        await client.close()
+    words_count = args.clients * args.queries * args.words
+    return {
+        "params": {"clients": args.clients, "queries": args.queries, "words": args.words, "length": args.length,
+                   "pipeline": args.pipeline, "grammar": args.grammar, "engine": args.engine},
+        "seconds": elapsed,
+        "words_per_second": words_count / elapsed,
+        "latency": get_latency_metrics(latencies),
+        "server": server_stats,
+    }
+
+
+def spawn_server(args):
+    args.socket = os.path.join(tempfile.mkdtemp(), "match.sock")
+    # Server doesn't hold stdout, so output of the test can be piped
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+                               "--socket", args.socket, "--jobs", str(args.jobs)], stdout=subprocess.DEVNULL)
+    # Wait for socket
+    for i in range(100):
+        if os.path.exists(args.socket) or server.poll() is not None:
+            break
+        time.sleep(0.1)
+    if not os.path.exists(args.socket):
+        server.kill()
+        server.wait()
+        shutil.rmtree(os.path.dirname(args.socket), ignore_errors=True)
+        raise RuntimeError("Server did not start")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures throughput and latency of matching server")
+    parser.add_argument("--spawn", action="store_true", help="start server on temporary socket for the test")
+    parser.add_argument("--socket", help="path of Unix socket of server")
+    parser.add_argument("--port", type=int, help="TCP port of server")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP host of server")
+    parser.add_argument("--jobs", type=int, default=0, help="number of worker processes of spawned server")
+    parser.add_argument("--clients", type=int, default=8, help="number of concurrent connections")
+    parser.add_argument("--queries", type=int, default=100, help="number of queries of every client")
+    parser.add_argument("--words", type=int, default=64, help="number of words in query")
+    parser.add_argument("--length", type=int, default=20, help="length of words")
+    parser.add_argument("--pipeline", type=int, default=4, help="queries in flight per client")
+    parser.add_argument("--grammar", choices=[family[0] for family in GRAMMAR_FAMILIES], default="dyck")
+    parser.add_argument("--engine", default=None, help="how to check grammar, see main.py")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="file for JSON results, stdout by default")
+    args = parser.parse_args()
+    if not args.spawn and args.socket is None and args.port is None:
+        parser.error("one of --spawn, --socket, --port is required")
+
+    server = spawn_server(args) if args.spawn else None
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            # Server shuts down its workers on SIGTERM
+            server.terminate()
+            server.wait()
+            shutil.rmtree(os.path.dirname(args.socket), ignore_errors=True)
+    if args.output is None:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as output_file:
+            json.dump(result, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
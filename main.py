@@ -1,33 +1,140 @@
-from automata import DFA
+from automata import DFA, LazyDFA, NFA
+from cache import CompiledCache
 from grammar import CFG
+from intersection import LanguageIntersection
+import stats
 
 __author__ = 'drack3800'
 
+import argparse
+import itertools
 import sys
 
-regex = sys.argv[1]
-grammar_file = open(sys.argv[2], 'r')
-num_of_tests = int(sys.argv[3])
+# Size of chunks for reading words and writing answers
+BUFFER_SIZE = 1 << 20
 
-# Skip number, cuz python can read all lines without their amount
-grammar_file.readline()
 
-production_rules = []
-# Read first rule and determine start symbol in grammar
-rule_list = list(part.strip() for part in grammar_file.readline().split())
-start = rule_list[0]
-production_rules.append((start, ' '.join(rule_list[1::])))
+def read_production_rules(grammar_file):
+    """
+    Return list of (left, right) rules from grammar file, the start symbol is the left part of the first one
+    """
+    # Skip number, cuz python can read all lines without their amount
+    grammar_file.readline()
 
-for rule in grammar_file.readlines():
-    rule_list = list(part.strip() for part in rule.split())
-    production_rules.append((rule_list[0], ' '.join(rule_list[1:])))
+    production_rules = []
+    for rule in grammar_file.readlines():
+        rule_list = rule.split()
+        # Blank lines are skipped
+        if len(rule_list) > 0:
+            production_rules.append((rule_list[0], ' '.join(rule_list[1:])))
+    return production_rules
 
-grammar = CFG(start, production_rules)
-automaton = DFA(regex)
 
-for i in range(num_of_tests):
-    word = sys.stdin.readline().strip()
-    if grammar.accept_word(word) and automaton.accept_word(word):
-        print("YES")
+def read_grammar(grammar_file, engine=CFG.CYK):
+    production_rules = read_production_rules(grammar_file)
+    if len(production_rules) == 0:
+        raise SyntaxError("Grammar has no rules")
+    return CFG(production_rules[0][0], production_rules, engine)
+
+
+def read_words(stream, buffer_size=BUFFER_SIZE):
+    """
+    Generator of words from binary stream, one word per line, until EOF.
+    Stream is read in large chunks instead of line by line.
+    """
+    rest = b""
+    while True:
+        chunk = stream.read(buffer_size)
+        if not chunk:
+            break
+        chunk = rest + chunk
+        # Only complete lines are decoded, the tail waits for the next chunk
+        last_line_end = chunk.rfind(b"\n") + 1
+        rest = chunk[last_line_end:]
+        for line in chunk[:last_line_end].decode().split("\n")[:-1]:
+            yield line.strip()
+    if rest:
+        yield rest.decode().strip()
+
+
+def write_answers(answers, stream, buffer_size=BUFFER_SIZE):
+    # Answers are joined into chunks, so there is one write call per chunk
+    lines = []
+    size = 0
+    for answer in answers:
+        line = b"YES\n" if answer else b"NO\n"
+        lines.append(line)
+        size += len(line)
+        if size >= buffer_size:
+            stream.write(b"".join(lines))
+            lines = []
+            size = 0
+    stream.write(b"".join(lines))
+    stream.flush()
+
+
+def build_intersection(regex, grammar, automaton="dfa", product=False, cache=None):
+    """
+    Return LanguageIntersection of regex and grammar, automaton is "dfa", "lazy" or "nfa" (see parse_args)
+    With CompiledCache compiled automaton and grammar are taken from it
+    """
+    if cache is not None and (grammar.engine != CFG.EARLEY or product):
+        cache.get_grammar(grammar)
+    if automaton == "lazy":
+        automaton = LazyDFA(regex)
+    elif automaton == "nfa":
+        automaton = NFA(regex)
+    elif cache is not None:
+        automaton = cache.get_automaton(regex)
     else:
-        print("NO")
\ No newline at end of file
+        automaton = DFA(regex, minimize=True)
+    # Both are compiled once here and shipped to workers together, cheap checks go first
+    return LanguageIntersection(automaton, grammar, product=product)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Checks words from stdin for membership in L(regex) and L(grammar)")
+    parser.add_argument("regex", help="regular expression in postfix notation")
+    parser.add_argument("grammar_file", help="file with grammar rules")
+    parser.add_argument("num_of_tests", type=int, nargs="?", default=None,
+                        help="number of words to check, by default all words until EOF")
+    parser.add_argument("--product", action="store_true",
+                        help="check words against one grammar of the intersection instead of regex and grammar")
+    parser.add_argument("--automaton", choices=["dfa", "lazy", "nfa"], default="dfa",
+                        help="how to match regex: full DFA (default), DFA built on the fly (lazy) "
+                             "or NFA simulation (nfa), the last two are for regexes with huge DFA")
+    parser.add_argument("--engine", choices=CFG.ENGINES, default=CFG.CYK,
+                        help="how to check grammar: CYK on Chomsky Normal Form (default), CYK which reuses "
+                             "the chart for common prefixes of words (incremental) "
+                             "or Earley on the grammar itself, which is faster for unambiguous grammars")
+    parser.add_argument("--cache-dir", default=None,
+                        help="directory for compiled automata and grammars, reused by next runs")
+    parser.add_argument("--jobs", type=int, default=1, help="number of worker processes, 0 means all cores")
+    parser.add_argument("--stats", action="store_true",
+                        help="print counters and timers of construction and matching to stderr at the end")
+    args = parser.parse_args()
+    if args.automaton != "dfa" and args.product:
+        parser.error("--product needs full DFA")
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.stats:
+        stats.enable()
+    with stats.timer("main.build"):
+        with open(args.grammar_file, 'r') as grammar_file:
+            grammar = read_grammar(grammar_file, args.engine)
+        cache = CompiledCache(args.cache_dir) if args.cache_dir is not None else None
+        intersection = build_intersection(args.regex, grammar, args.automaton, args.product, cache)
+    words = read_words(sys.stdin.buffer)
+    if args.num_of_tests is not None:
+        words = itertools.islice(words, args.num_of_tests)
+    with stats.timer("main.check"):
+        write_answers(intersection.accept_words(words, args.jobs), sys.stdout.buffer)
+    if args.stats:
+        sys.stderr.write(str(intersection) + str(stats.get_stats()))
+
+
+if __name__ == "__main__":
+    main()
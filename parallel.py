@@ -0,0 +1,109 @@
+__author__ = 'drack3800'
+
+import collections
+import itertools
+import multiprocessing
+import os
+
+import stats
+
+"""
+Checking of many words against compiled recognizers on a pool of processes.
+Recognizer is any picklable object with accept_word(word) method (CompiledDFA, CYKRecognizer, ...).
+It is sent to every worker once, then words are sent in chunks and answers come back in input order.
+When stats are enabled, workers send their stats back with answers and they are merged into stats of this process.
+"""
+
+CHUNK_SIZE = 1024
+# Chunks waiting in the pool per worker, bounds memory for endless word streams
+CHUNKS_PER_JOB = 4
+
+# Recognizer of the current worker process
+_recognizer = None
+
+
+def get_jobs_count(jobs):
+    # Non-positive number of jobs means "all cores"
+    if jobs is None or jobs <= 0:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def accept_words(recognizer, words, jobs=1, chunk_size=CHUNK_SIZE):
+    """
+    Generator of recognizer.accept_word(word) answers for words, in the same order.
+    With jobs > 1 words are checked on a pool of jobs processes.
+    """
+    return map_words(recognizer, "accept_word", words, jobs, chunk_size)
+
+
+def map_words(recognizer, method, words, jobs=1, chunk_size=CHUNK_SIZE):
+    """
+    Generator of getattr(recognizer, method)(word) results for words, in the same order.
+    """
+    jobs = get_jobs_count(jobs)
+    if jobs == 1:
+        function = getattr(recognizer, method)
+        for word in words:
+            yield function(word)
+        return
+    yield from _map_on_pool(recognizer, method, False, words, jobs, chunk_size)
+
+
+def map_batches(recognizer, method, words, jobs=1, chunk_size=CHUNK_SIZE):
+    """
+    The same as map_words, but getattr(recognizer, method) takes a list of words and returns a list of results,
+    so it can share work between words of one chunk.
+    """
+    jobs = get_jobs_count(jobs)
+    if jobs == 1:
+        function = getattr(recognizer, method)
+        for chunk in _split_into_chunks(words, chunk_size):
+            yield from function(chunk)
+        return
+    yield from _map_on_pool(recognizer, method, True, words, jobs, chunk_size)
+
+
+def _map_on_pool(recognizer, method, batch, words, jobs, chunk_size):
+    with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(recognizer, stats.enabled)) as pool:
+        pending = collections.deque()
+        for chunk in _split_into_chunks(words, chunk_size):
+            pending.append(pool.apply_async(_map_chunk, (method, batch, chunk)))
+            if len(pending) >= jobs * CHUNKS_PER_JOB:
+                yield from _get_results(pending.popleft())
+        while len(pending) > 0:
+            yield from _get_results(pending.popleft())
+
+
+def _get_results(pending_result):
+    results, worker_stats = pending_result.get()
+    if worker_stats is not None:
+        stats.get_stats().merge(worker_stats)
+    return results
+
+
+def _init_worker(recognizer, stats_enabled):
+    global _recognizer
+    _recognizer = recognizer
+    if stats_enabled:
+        stats.enable()
+
+
+def _map_chunk(method, batch, words):
+    # Stats are gathered per chunk, so every chunk sends only its own counters
+    stats.reset()
+    function = getattr(_recognizer, method)
+    if batch:
+        results = function(words)
+    else:
+        results = [function(word) for word in words]
+    return results, stats.get_stats() if stats.enabled else None
+
+
+def _split_into_chunks(words, chunk_size):
+    words = iter(words)
+    while True:
+        chunk = list(itertools.islice(words, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
@@ -0,0 +1,410 @@
+from cache import CompiledCache
+from grammar import CFG
+from main import build_intersection
+import parallel
+
+__author__ = 'drack3800'
+
+import argparse
+import asyncio
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+
+"""
+Long-running matching service: regex and grammar pairs are compiled once and then
+words are checked against them (like main.py) without interpreter startup and compilation per job.
+
+Protocol is JSON lines over Unix socket or TCP, one request per line, one response per request,
+responses go in the order of requests of the connection:
+    {"id": 1, "op": "register", "regex": "ab+*", "grammar": [["S", "a S b"], ["S", ""]]}
+        -> {"id": 1, "ok": true, "pair": "<key>"}
+       optional fields: "engine" ("cyk", "incremental", "earley"), "automaton" ("dfa", "lazy", "nfa"), "product"
+    {"id": 2, "op": "query", "pair": "<key>", "words": ["ab", "ba"]}
+        -> {"id": 2, "ok": true, "answers": [true, false]}
+    {"id": 3, "op": "stats"}
+        -> {"id": 3, "ok": true, "stats": {...}}
+Errors are {"id": ..., "ok": false, "error": "..."}.
+Start symbol of grammar is the left part of its first rule, like in grammar files of main.py.
+
+Words of queries to one pair are gathered into batches (up to BATCH_SIZE words or BATCH_DELAY seconds)
+and batches are checked on a pool of processes. Every worker compiles a pair once, on its first batch.
+Backpressure: a connection has at most MAX_PENDING requests in work, then the server stops reading it,
+and at most jobs * BATCHES_PER_JOB batches are in the pool at once.
+When a connection is lost, its requests in work are cancelled.
+SIGTERM or SIGINT stops the server together with its worker processes.
+"""
+
+BATCH_SIZE = 512
+BATCH_DELAY = 0.002
+MAX_PENDING = 64
+BATCHES_PER_JOB = 2
+# Lines are long, as a query holds many words
+LINE_LIMIT = 16 << 20
+# Compiled pairs kept by every worker process
+WORKER_PAIRS = 64
+
+# Compiled pairs of the current worker process: key -> LanguageIntersection, the most recently used at the end
+_intersections = collections.OrderedDict()
+_cache = None
+
+
+class MatchServer():
+    """
+    Initializes with number of worker processes (0 means all cores) and optional cache directory,
+    which is shared by workers (see CompiledCache)
+    Example: asyncio.run(MatchServer(jobs=4).serve_unix("/tmp/match.sock"))
+    """
+
+    def __init__(self, jobs=0, cache_dir=None, batch_size=BATCH_SIZE, batch_delay=BATCH_DELAY):
+        self.jobs = parallel.get_jobs_count(jobs)
+        self.cache_dir = cache_dir
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.pool = None
+        self.slots = None
+        # key -> spec of registered pair, key -> Batcher
+        self.pairs = {}
+        self.batchers = {}
+        self.counters = {"connections": 0, "queries": 0, "words": 0, "batches": 0, "errors": 0}
+
+    async def serve_unix(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(self.handle_connection, path, limit=LINE_LIMIT)
+        try:
+            await self.__serve(server)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    async def serve_tcp(self, host, port):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=LINE_LIMIT)
+        await self.__serve(server)
+
+    async def __serve(self, server):
+        # SIGTERM and SIGINT stop the server, so worker processes are shut down too
+        loop = asyncio.get_running_loop()
+        stopping = asyncio.Event()
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signal_number, stopping.set)
+        self.start()
+        try:
+            await stopping.wait()
+        finally:
+            for signal_number in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(signal_number)
+            server.close()
+            self.stop()
+
+    def start(self):
+        self.pool = multiprocessing.Pool(self.jobs, initializer=_init_worker, initargs=(self.cache_dir,))
+        self.slots = asyncio.Semaphore(self.jobs * BATCHES_PER_JOB)
+
+    def stop(self):
+        if self.pool is not None:
+            # Batches in work are not waited for, only workers of the pool are terminated
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def run_in_pool(self, function, *args):
+        """
+        Return future of function(*args) computed by a worker
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Callbacks are called by a thread of the pool
+        self.pool.apply_async(function, args,
+                              callback=lambda res: loop.call_soon_threadsafe(_set_result, future, res),
+                              error_callback=lambda error: loop.call_soon_threadsafe(_set_exception, future, error))
+        return future
+
+    async def handle_connection(self, reader, writer):
+        self.counters["connections"] += 1
+        # Responses are written in order, queue size bounds requests in work
+        responses = asyncio.Queue(MAX_PENDING)
+        reading = asyncio.ensure_future(self.__read_requests(reader, responses))
+        writing = asyncio.ensure_future(self.__write_responses(responses, writer, reading))
+        try:
+            # Reading ends at the end of requests or is cancelled by writer when client is gone
+            await asyncio.wait([reading])
+            # Writer takes everything from queue until None, so put never blocks for good
+            await responses.put(None)
+            await writing
+        except asyncio.CancelledError:
+            # Server stops
+            pass
+        finally:
+            reading.cancel()
+            writing.cancel()
+            while not responses.empty():
+                response = responses.get_nowait()
+                if response is not None:
+                    response.cancel()
+            writer.close()
+
+    async def __read_requests(self, reader, responses):
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                # Line is longer than LINE_LIMIT, the rest of stream can't be parsed
+                await responses.put(_get_done_future(_error_response(None, "Request is too long")))
+                return
+            except ConnectionError:
+                return
+            if not line:
+                return
+            if line.strip():
+                await responses.put(asyncio.ensure_future(self.handle_request(line)))
+
+    async def __write_responses(self, responses, writer, reading):
+        # Completes when connection is lost, even if no response is ready to be written
+        closed = asyncio.ensure_future(_wait_closed(writer))
+        connected = True
+        try:
+            while True:
+                response = await responses.get()
+                if response is None:
+                    return
+                if connected:
+                    await asyncio.wait([response, closed], return_when=asyncio.FIRST_COMPLETED)
+                    connected = not closed.done()
+                if not connected:
+                    # Nobody will read the answer, requests of the connection are dropped
+                    reading.cancel()
+                    response.cancel()
+                    continue
+                try:
+                    writer.write(json.dumps(response.result()).encode() + b"\n")
+                    await writer.drain()
+                except ConnectionError:
+                    connected = False
+                    reading.cancel()
+        finally:
+            closed.cancel()
+
+    async def handle_request(self, line):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request must be an object")
+            request_id = request.get("id")
+            op = request.get("op")
+            if op == "register":
+                res = {"pair": await self.register(request)}
+            elif op == "query":
+                res = {"answers": await self.query(request.get("pair"), request.get("words"))}
+            elif op == "stats":
+                res = {"stats": self.get_stats()}
+            else:
+                raise ValueError("Unknown op {0}".format(op))
+        except Exception as error:
+            # Any failure of request (bad request, bad regex or grammar, broken worker) is reported to client,
+            # the connection and the server go on
+            self.counters["errors"] += 1
+            return _error_response(request_id, error)
+        res["id"] = request_id
+        res["ok"] = True
+        return res
+
+    async def register(self, request):
+        grammar = request.get("grammar")
+        if not isinstance(grammar, list) or len(grammar) == 0:
+            raise ValueError("Grammar must be a non-empty list of [left, right] rules")
+        spec = (
+            str(request["regex"]),
+            tuple((str(left), str(right)) for left, right in grammar),
+            request.get("engine", CFG.CYK),
+            request.get("automaton", "dfa"),
+            bool(request.get("product", False)),
+        )
+        if spec[2] not in CFG.ENGINES or spec[3] not in ("dfa", "lazy", "nfa"):
+            raise ValueError("Unknown engine or automaton")
+        if spec[4] and spec[3] != "dfa":
+            raise ValueError("Product needs full DFA")
+        key = hashlib.sha256(json.dumps(spec).encode()).hexdigest()
+        if key not in self.pairs:
+            # Pair is compiled by a worker once to check it, bad regex or grammar is reported here
+            async with self.slots:
+                await self.run_in_pool(_register, key, spec)
+            self.pairs[key] = spec
+            self.batchers[key] = Batcher(self, key, spec)
+        return key
+
+    async def query(self, key, words):
+        if key not in self.batchers:
+            raise ValueError("Unknown pair {0}".format(key))
+        if not isinstance(words, list) or not all(isinstance(word, str) for word in words):
+            raise ValueError("Words must be a list of strings")
+        self.counters["queries"] += 1
+        self.counters["words"] += len(words)
+        if len(words) == 0:
+            return []
+        return await self.batchers[key].check(words)
+
+    async def run_batch(self, key, spec, words):
+        self.counters["batches"] += 1
+        return await self.run_in_pool(_match_batch, key, spec, words)
+
+    def get_stats(self):
+        res = dict(self.counters)
+        res["pairs"] = len(self.pairs)
+        res["jobs"] = self.jobs
+        return res
+
+
+class Batcher():
+    """
+    Gathers words of queries to one pair and checks them in batches of up to batch_size words
+    A batch is sent when it is full or batch_delay seconds after its first query.
+    """
+
+    def __init__(self, server, key, spec):
+        self.server = server
+        self.key = key
+        self.spec = spec
+        # Queries of the current batch: list of (words, future)
+        self.queries = []
+        self.words_count = 0
+        self.timer = None
+
+    async def check(self, words):
+        future = asyncio.get_running_loop().create_future()
+        self.queries.append((words, future))
+        self.words_count += len(words)
+        if self.words_count >= self.server.batch_size:
+            self.__flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.server.batch_delay, self.__flush)
+        return await future
+
+    def __flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        queries = self.queries
+        self.queries = []
+        self.words_count = 0
+        if len(queries) > 0:
+            asyncio.ensure_future(self.__run(queries))
+
+    async def __run(self, queries):
+        async with self.server.slots:
+            # Queries of lost connections are cancelled while batch waits for its turn
+            queries = [(query_words, future) for query_words, future in queries if not future.done()]
+            if len(queries) == 0:
+                return
+            words = [word for query_words, future in queries for word in query_words]
+            try:
+                answers = await self.server.run_batch(self.key, self.spec, words)
+            except Exception as error:
+                for query_words, future in queries:
+                    if not future.done():
+                        future.set_exception(error)
+                return
+        offset = 0
+        for query_words, future in queries:
+            if not future.done():
+                future.set_result(answers[offset:offset + len(query_words)])
+            offset += len(query_words)
+
+
+def _error_response(request_id, error):
+    return {"id": request_id, "ok": False, "error": str(error)}
+
+
+async def _wait_closed(writer):
+    try:
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+
+
+def _set_result(future, result):
+    # Future may be cancelled while worker was busy
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, error):
+    if not future.done():
+        future.set_exception(error)
+
+
+def _get_done_future(result):
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(result)
+    return future
+
+
+def _init_worker(cache_dir):
+    global _cache
+    # Forked workers inherit signal handlers of the server loop, which would ignore SIGTERM of stop()
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if cache_dir is not None:
+        _cache = CompiledCache(cache_dir)
+
+
+def _compile(key, spec):
+    intersection = _intersections.get(key)
+    if intersection is None:
+        regex, rules, engine, automaton, product = spec
+        grammar = CFG(rules[0][0], rules, engine)
+        intersection = build_intersection(regex, grammar, automaton, product, _cache)
+        _intersections[key] = intersection
+        if len(_intersections) > WORKER_PAIRS:
+            _intersections.popitem(last=False)
+    else:
+        _intersections.move_to_end(key)
+    return intersection
+
+
+def _register(key, spec):
+    # Compiled pair stays in the worker, only errors go back
+    _compile(key, spec)
+
+
+def _match_batch(key, spec, words):
+    intersection = _compile(key, spec)
+    # Stages are not recorded, statistics of the whole service are kept by the server
+    return [stage is None for stage in intersection.get_rejecting_stages(words)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serves membership queries for regex and grammar pairs")
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument("--socket", help="path of Unix socket")
+    address.add_argument("--port", type=int, help="TCP port")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP host")
+    parser.add_argument("--jobs", type=int, default=0, help="number of worker processes, 0 means all cores")
+    parser.add_argument("--cache-dir", default=None,
+                        help="directory for compiled automata and grammars, shared by workers")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="maximal number of words in batch")
+    parser.add_argument("--batch-delay", type=float, default=BATCH_DELAY,
+                        help="seconds to wait for more words before sending batch")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = MatchServer(args.jobs, args.cache_dir, args.batch_size, args.batch_delay)
+    if args.socket is not None:
+        coroutine = server.serve_unix(args.socket)
+    else:
+        coroutine = server.serve_tcp(args.host, args.port)
+    try:
+        asyncio.run(coroutine)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
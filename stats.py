@@ -0,0 +1,110 @@
+__author__ = 'drack3800'
+
+import time
+
+"""
+Optional instrumentation of construction and matching: named counters and wall-clock timers.
+Example:
+    stats.enable()
+    DFA("ab+*", minimize=True)
+    print(stats.get_stats())
+
+Names are "<part>.<what>": "nfa.states", "cnf.rules.bin", "cyk.cells", ...
+Counters are summed over all automata and grammars built while stats are enabled.
+
+Disabled stats cost near zero: call sites check stats.enabled (one attribute read) before counting,
+counting is done once per construction phase or per word, never inside inner loops,
+and timer() returns a shared context manager which does nothing.
+"""
+
+enabled = False
+
+
+class Stats():
+    """
+    self.counters is a dict: name -> number, self.timers is a dict: name -> seconds
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.timers = {}
+
+    def add(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name, seconds):
+        self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+    def merge(self, other):
+        # Stats of worker processes are merged into stats of the main process
+        for name, value in other.counters.items():
+            self.add(name, value)
+        for name, seconds in other.timers.items():
+            self.add_time(name, seconds)
+
+    def __str__(self):
+        res = ""
+        for name in sorted(self.counters.keys()):
+            res += "{0}: {1}\n".format(name, self.counters[name])
+        for name in sorted(self.timers.keys()):
+            res += "{0}: {1:.6f}s\n".format(name, self.timers[name])
+        return res
+
+
+class _Timer():
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _stats.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoTimer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_stats = Stats()
+_NO_TIMER = _NoTimer()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    global _stats
+    _stats = Stats()
+
+
+def get_stats():
+    return _stats
+
+
+def add(name, value=1):
+    if enabled:
+        _stats.add(name, value)
+
+
+def timer(name):
+    """
+    Context manager which adds its wall-clock time to timer name
+    """
+    if enabled:
+        return _Timer(name)
+    return _NO_TIMER